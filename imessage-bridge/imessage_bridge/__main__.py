@@ -16,17 +16,23 @@ import logging
 import signal
 import sys
 
+import httpx
+
 from .config import Config
+from .sender.imessage import close_sender
 from .sender.listener import RealtimeListener
 from .sender.outbound_poller import OutboundPoller
 from .state import BridgeState
-from .watcher.chat_db import get_max_rowid
+from .watcher.chat_db import close_chat_db, get_max_rowid
 from .watcher.fs_monitor import start_watcher
 from .watcher.processor import MessageProcessor
 from .watcher.trigger_checker import TriggerChecker
 
 logger = logging.getLogger("imessage_bridge")
 
+# How often dirty bridge state is flushed to disk
+STATE_FLUSH_INTERVAL = 1.0
+
 
 def _setup_logging(level: str) -> None:
     logging.basicConfig(
@@ -39,6 +45,31 @@ def _setup_logging(level: str) -> None:
     logging.getLogger("httpcore").setLevel(logging.WARNING)
 
 
+def _make_supabase_http(config: Config) -> httpx.AsyncClient:
+    """Shared keep-alive client for Supabase REST calls."""
+    return httpx.AsyncClient(
+        base_url=config.supabase_url,
+        http2=True,
+        timeout=15.0,
+        headers={
+            "Authorization": f"Bearer {config.supabase_service_role_key}",
+            "apikey": config.supabase_service_role_key,
+        },
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60.0),
+    )
+
+
+async def _flush_state(state: BridgeState) -> None:
+    """Periodically persist state marked dirty by the components."""
+    while True:
+        await asyncio.sleep(STATE_FLUSH_INTERVAL)
+        if state.dirty:
+            try:
+                await state.save()
+            except OSError:
+                logger.exception("Failed to save bridge state")
+
+
 async def _run() -> None:
     config = Config.from_env()
     _setup_logging(config.log_level)
@@ -64,12 +95,14 @@ async def _run() -> None:
     if state.last_rowid == 0:
         current_max = get_max_rowid(config.chat_db_path)
         state.last_rowid = current_max
-        state.save()
+        await state.save()
         logger.info(
             "First run detected — skipping historical messages (set last_rowid=%d)",
             current_max,
         )
 
+    flush_task = asyncio.create_task(_flush_state(state), name="state_flush")
+
     # Watcher: FSEvents + poll on chat.db → detect new messages → call agent → reply
     processor = MessageProcessor(config, state)
     watcher_task = asyncio.create_task(
@@ -82,14 +115,17 @@ async def _run() -> None:
     )
 
     # Trigger checker: polls v2-trigger every 60s for upcoming meeting preps
-    trigger_checker = TriggerChecker(config)
+    trigger_checker = TriggerChecker(config, state)
     trigger_task = asyncio.create_task(
         trigger_checker.run(),
         name="trigger_checker",
     )
 
+    # Shared Supabase REST client (HTTP/2, kept alive across components)
+    shared_http = _make_supabase_http(config)
+
     # Outbound poller: delivers queued iMessages from edge functions
-    outbound_poller = OutboundPoller(config)
+    outbound_poller = OutboundPoller(config, http=shared_http)
     outbound_task = asyncio.create_task(
         outbound_poller.run(),
         name="outbound_poller",
@@ -107,23 +143,23 @@ async def _run() -> None:
         loop.add_signal_handler(sig, _signal_handler)
 
     # Wait for shutdown or task failure
+    main_tasks = {watcher_task, trigger_task, outbound_task}
+    shutdown_task = asyncio.ensure_future(shutdown_event.wait())
     done, pending = await asyncio.wait(
-        [watcher_task, trigger_task, outbound_task, asyncio.create_task(shutdown_event.wait())],
+        main_tasks | {shutdown_task},
         return_when=asyncio.FIRST_COMPLETED,
     )
+    shutdown_task.cancel()
+    pending.discard(shutdown_task)
 
     # Check for unexpected failures
-    for task in done:
-        if task.get_name() in ("watcher", "trigger_checker", "outbound_poller") and task.exception():
+    for task in done & main_tasks:
+        if task.exception():
             logger.error("%s failed: %s", task.get_name(), task.exception())
 
-    # Cleanup
+    # Cleanup: stop everything that can mark state dirty before the final
+    # save, so nothing recorded during shutdown is lost
     logger.info("Shutting down...")
-    state.save()
-    await processor.close()
-    await trigger_checker.close()
-    await outbound_poller.close()
-
     for task in pending:
         task.cancel()
         try:
@@ -131,6 +167,21 @@ async def _run() -> None:
         except asyncio.CancelledError:
             pass
 
+    await processor.close()
+    await trigger_checker.close()
+    await outbound_poller.close()
+    await close_sender()
+
+    flush_task.cancel()
+    try:
+        await flush_task
+    except asyncio.CancelledError:
+        pass
+    await state.save()
+
+    close_chat_db()
+    await shared_http.aclose()
+
     logger.info("Goodbye")
 
 
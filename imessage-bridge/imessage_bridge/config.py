@@ -21,7 +21,10 @@ class Config:
 
     @classmethod
     def from_env(cls) -> Config:
-        load_dotenv()
+        # DOTENV=0 skips the .env lookup when a service manager (launchd,
+        # systemd) already provides the whole environment
+        if os.getenv("DOTENV", "1") != "0":
+            load_dotenv()
         required = [
             "SUPABASE_URL",
             "SUPABASE_SERVICE_ROLE_KEY",
@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
 import random
 import re
@@ -13,6 +14,9 @@ MAX_MESSAGE_LENGTH = 2000
 MAX_RETRIES = 3
 RETRY_DELAY = 2.0
 OSASCRIPT_TIMEOUT = 15.0  # seconds — kill if Messages.app hangs
+# Retries for a chunk whose send may or may not have gone through; kept at
+# one so a flaky coprocess can cause at most one duplicate bubble
+MAX_UNCONFIRMED_RETRIES = 1
 
 # Delay range (seconds) between conversational messages to feel human
 MIN_INTER_MSG_DELAY = 1.8
@@ -22,29 +26,42 @@ MAX_INTER_MSG_DELAY = 2.5
 _BOLD_UPPER = {chr(c): chr(0x1D5D4 + (c - ord("A"))) for c in range(ord("A"), ord("Z") + 1)}
 _BOLD_LOWER = {chr(c): chr(0x1D5EE + (c - ord("a"))) for c in range(ord("a"), ord("z") + 1)}
 _BOLD_DIGIT = {chr(c): chr(0x1D7EC + (c - ord("0"))) for c in range(ord("0"), ord("9") + 1)}
-_BOLD_MAP = {**_BOLD_UPPER, **_BOLD_LOWER, **_BOLD_DIGIT}
+_BOLD_TABLE = str.maketrans({**_BOLD_UPPER, **_BOLD_LOWER, **_BOLD_DIGIT})
 
 
 def _to_unicode_bold(text: str) -> str:
     """Convert ASCII text to Unicode Mathematical Sans-Serif Bold glyphs."""
-    return "".join(_BOLD_MAP.get(c, c) for c in text)
+    return text.translate(_BOLD_TABLE)
 
 
 def _apply_bold(match: re.Match) -> str:
     return _to_unicode_bold(match.group(1))
 
 
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+_ITALIC_RE = re.compile(r"\*(.+?)\*")
+_HEADING_RE = re.compile(r"^#{1,4}\s+", re.MULTILINE)
+_BULLET_RE = re.compile(r"^- ", re.MULTILINE)
+_CODE_RE = re.compile(r"`(.+?)`")
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+
+# Substrings at least one of which must be present for any pattern above to match
+_MARKDOWN_TOKENS = ("*", "#", "`", "<!--", "- ")
+
+
 def strip_markdown(text: str) -> str:
     """Convert markdown to iMessage-friendly text with Unicode bold.
 
     Preserves <nest-content> tags for the splitter to handle.
     """
-    text = re.sub(r"\*\*(.+?)\*\*", _apply_bold, text)
-    text = re.sub(r"\*(.+?)\*", r"\1", text)
-    text = re.sub(r"^#{1,4}\s+", "", text, flags=re.MULTILINE)
-    text = re.sub(r"^- ", "• ", text, flags=re.MULTILINE)
-    text = re.sub(r"`(.+?)`", r"\1", text)
-    text = re.sub(r"<!--.*?-->", "", text, flags=re.DOTALL)
+    if not any(tok in text for tok in _MARKDOWN_TOKENS):
+        return text.strip()
+    text = _BOLD_RE.sub(_apply_bold, text)
+    text = _ITALIC_RE.sub(r"\1", text)
+    text = _HEADING_RE.sub("", text)
+    text = _BULLET_RE.sub("• ", text)
+    text = _CODE_RE.sub(r"\1", text)
+    text = _COMMENT_RE.sub("", text)
     return text.strip()
 
 
@@ -55,6 +72,11 @@ _SINGLE_MESSAGE_THRESHOLD = 0
 
 _SEPARATOR_RE = re.compile(r"\s*---\s*")
 
+# Splits conversational text on --- markers.  Deliberately not MULTILINE:
+# ^/$ anchor to the segment edges only, as the mid-text cases are covered
+# by the \n---\n and \s+---\s+ alternatives.
+_SEP_SPLIT_RE = re.compile(r"\n---\n|\n---$|^---\n|\s+---\s+|\s+---$|^---\s+")
+
 _NEST_CONTENT_RE = re.compile(
     r"<nest-content>(.*?)</nest-content>", re.DOTALL
 )
@@ -71,6 +93,15 @@ def _split_conversational(text: str) -> list[str]:
     <nest-content> blocks are sent as single messages (never split).
     Raw text outside those blocks is split by newlines / --- markers.
     """
+    # Common case: a single short line with nothing to split on
+    if (
+        len(text) <= MAX_MESSAGE_LENGTH
+        and "\n" not in text
+        and "---" not in text
+        and "<nest-content>" not in text
+    ):
+        return [text.strip()]
+
     # Extract <nest-content> blocks and interleave with raw text
     segments: list[tuple[str, bool]] = []  # (text, is_block)
     last_end = 0
@@ -96,14 +127,12 @@ def _split_conversational(text: str) -> list[str]:
                 chunks.extend(_split_by_paragraphs(segment_text))
             continue
 
-        has_separator = "---" in segment_text
-        if has_separator:
-            parts = re.split(
-                r"\n---\n|\n---$|^---\n|\s+---\s+|\s+---$|^---\s+",
-                segment_text,
-            )
+        if "---" in segment_text:
+            parts = _SEP_SPLIT_RE.split(segment_text)
+        elif "\n" in segment_text:
+            parts = segment_text.split("\n")
         else:
-            parts = segment_text.split("\n") if "\n" in segment_text else [segment_text]
+            parts = [segment_text]
 
         for part in parts:
             part = part.strip()
@@ -123,21 +152,183 @@ def _split_conversational(text: str) -> list[str]:
 def _split_by_paragraphs(text: str) -> list[str]:
     """Split a long text at paragraph boundaries."""
     chunks: list[str] = []
-    current = ""
+    current: list[str] = []
+    current_len = 0  # length of "\n\n".join(current)
     for paragraph in text.split("\n\n"):
-        if current and len(current) + len(paragraph) + 2 > MAX_MESSAGE_LENGTH:
-            chunks.append(current.strip())
-            current = paragraph
+        if current_len and current_len + len(paragraph) + 2 > MAX_MESSAGE_LENGTH:
+            chunks.append("\n\n".join(current).strip())
+            current = [paragraph]
+            current_len = len(paragraph)
+        elif current_len:
+            current.append(paragraph)
+            current_len += len(paragraph) + 2
         else:
-            current = f"{current}\n\n{paragraph}" if current else paragraph
-    if current.strip():
-        chunks.append(current.strip())
+            current = [paragraph]
+            current_len = len(paragraph)
+    tail = "\n\n".join(current).strip()
+    if tail:
+        chunks.append(tail)
     return chunks or [text[:MAX_MESSAGE_LENGTH]]
 
 
+_APPLESCRIPT_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"'})
+
+
 def _escape_applescript(text: str) -> str:
     """Escape a string for embedding in an AppleScript double-quoted literal."""
-    return text.replace("\\", "\\\\").replace('"', '\\"')
+    return text.translate(_APPLESCRIPT_ESCAPES)
+
+
+# JXA loop run by the persistent osascript coprocess.  Each stdin line is a
+# JSON-encoded AppleScript source, compiled and executed in-process via
+# NSAppleScript; the reply is "OK" or "ERR <message>".  Input is ASCII-only
+# (json.dumps escapes non-ASCII) so chunked reads never split a character.
+_COPROCESS_JXA = r"""
+ObjC.import("Foundation");
+function run() {
+  const input = $.NSFileHandle.fileHandleWithStandardInput;
+  const output = $.NSFileHandle.fileHandleWithStandardOutput;
+  const reply = (s) => output.writeData($(s + "\n").dataUsingEncoding($.NSUTF8StringEncoding));
+  let buffer = "";
+  while (true) {
+    const data = input.availableData;
+    if (data.length === 0) return;
+    buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+    let nl;
+    while ((nl = buffer.indexOf("\n")) !== -1) {
+      const line = buffer.slice(0, nl);
+      buffer = buffer.slice(nl + 1);
+      if (!line) continue;
+      const err = Ref();
+      const script = $.NSAppleScript.alloc.initWithSource(JSON.parse(line));
+      const result = script.executeAndReturnError(err);
+      if (result && !result.isNil()) {
+        reply("OK");
+      } else {
+        const msg = err[0] ? ObjC.unwrap(err[0].objectForKey("NSAppleScriptErrorMessage")) : "";
+        reply("ERR " + String(msg || "unknown error").replace(/\n/g, " "));
+      }
+    }
+  }
+}
+"""
+
+
+# Error prefix for a script that reached the coprocess without a usable
+# reply.  It may already have sent, so it isn't re-run one-shot and is
+# retried at most MAX_UNCONFIRMED_RETRIES times.
+_UNCONFIRMED_ERROR = "unconfirmed"
+
+
+class IMessageSender:
+    """Persistent osascript coprocess for executing AppleScript sends.
+
+    Spawning ``osascript`` per chunk costs a fork plus runtime startup for
+    every bubble.  This keeps one process alive for the daemon's lifetime and
+    serialises scripts through it.  If the coprocess cannot be started or
+    written to, scripts fall back to a one-shot ``osascript -e`` call.
+    """
+
+    def __init__(self) -> None:
+        self._proc: asyncio.subprocess.Process | None = None
+        self._lock = asyncio.Lock()
+
+    async def run(self, script: str) -> tuple[bool, str]:
+        """Execute *script*.  Returns (success, error message).
+
+        Raises asyncio.TimeoutError if writing the script and reading its
+        reply take longer than OSASCRIPT_TIMEOUT in total; the coprocess is
+        killed and respawned by the next call, so a hung Messages.app holds
+        up the other senders for at most that long.
+        """
+        async with self._lock:
+            deadline = asyncio.get_running_loop().time() + OSASCRIPT_TIMEOUT
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await self._write_script(script)
+            except asyncio.TimeoutError:
+                await self._kill()
+                raise
+            except OSError as exc:
+                logger.warning("osascript coprocess unavailable (%s), using one-shot osascript", exc)
+                await self._kill()
+            else:
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        return await self._read_reply()
+                except asyncio.TimeoutError:
+                    await self._kill()
+                    raise
+                except (ConnectionError, ValueError) as exc:
+                    # The script was delivered and may have sent the message
+                    await self._kill()
+                    return False, f"{_UNCONFIRMED_ERROR}: {exc}"
+        return await _run_osascript_once(script)
+
+    async def _write_script(self, script: str) -> None:
+        if self._proc is None or self._proc.returncode is not None:
+            self._proc = await asyncio.create_subprocess_exec(
+                "osascript", "-l", "JavaScript", "-e", _COPROCESS_JXA,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            logger.debug("Started osascript coprocess (pid %d)", self._proc.pid)
+
+        self._proc.stdin.write(json.dumps(script).encode() + b"\n")
+        await self._proc.stdin.drain()
+
+    async def _read_reply(self) -> tuple[bool, str]:
+        line = await self._proc.stdout.readline()
+        if not line:
+            raise ConnectionError("osascript coprocess exited")
+
+        reply = line.decode(errors="replace").rstrip("\n")
+        if reply == "OK":
+            return True, ""
+        if reply.startswith("ERR"):
+            return False, reply[3:].strip()
+        raise ValueError(f"unexpected coprocess reply: {reply[:80]}")
+
+    async def _kill(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None or proc.returncode is not None:
+            return
+        proc.kill()
+        await proc.wait()
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._kill()
+
+
+async def _run_osascript_once(script: str) -> tuple[bool, str]:
+    """Run *script* in a fresh osascript process."""
+    proc = await asyncio.create_subprocess_exec(
+        "osascript", "-e", script,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await asyncio.wait_for(
+            proc.communicate(), timeout=OSASCRIPT_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+
+    if proc.returncode == 0:
+        return True, ""
+    return False, f"rc={proc.returncode}: {stderr.decode().strip()}"
+
+
+_sender = IMessageSender()
+
+
+async def close_sender() -> None:
+    """Terminate the osascript coprocess (call on shutdown)."""
+    await _sender.close()
 
 
 async def send_imessage(phone: str, text: str) -> bool:
@@ -162,45 +353,42 @@ async def send_imessage(phone: str, text: str) -> bool:
         )
 
         success = False
+        unconfirmed = 0
         for attempt in range(1, MAX_RETRIES + 1):
-            proc = await asyncio.create_subprocess_exec(
-                "osascript", "-e", script,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-            )
             try:
-                stdout, stderr = await asyncio.wait_for(
-                    proc.communicate(), timeout=OSASCRIPT_TIMEOUT,
-                )
+                ok, error = await _sender.run(script)
             except asyncio.TimeoutError:
                 logger.warning(
                     "osascript attempt %d/%d timed out after %.0fs — killing process",
                     attempt, MAX_RETRIES, OSASCRIPT_TIMEOUT,
                 )
-                proc.kill()
-                await proc.wait()
                 if attempt < MAX_RETRIES:
                     await asyncio.sleep(RETRY_DELAY)
                 continue
 
-            if proc.returncode == 0:
+            if ok:
                 success = True
                 break
+            if error.startswith(_UNCONFIRMED_ERROR):
+                # Retrying could send the chunk twice, so only a bounded number
+                unconfirmed += 1
+                if unconfirmed > MAX_UNCONFIRMED_RETRIES:
+                    logger.error("osascript result unknown, not retrying: %s", error)
+                    break
 
             logger.warning(
-                "osascript attempt %d/%d failed (rc=%d): %s",
+                "osascript attempt %d/%d failed: %s",
                 attempt,
                 MAX_RETRIES,
-                proc.returncode,
-                stderr.decode().strip(),
+                error,
             )
             if attempt < MAX_RETRIES:
                 await asyncio.sleep(RETRY_DELAY)
 
         if not success:
             logger.error(
-                "Failed to send chunk %d/%d after %d retries",
-                i + 1, len(chunks), MAX_RETRIES,
+                "Failed to send chunk %d/%d after %d attempt(s)",
+                i + 1, len(chunks), attempt,
             )
             return False
 
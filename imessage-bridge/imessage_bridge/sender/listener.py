@@ -23,18 +23,41 @@ logger = logging.getLogger("imessage_bridge.sender.listener")
 # How far back to look for unsent messages on startup (seconds)
 CATCHUP_WINDOW_SECONDS = 3600
 
+# Polling fallback interval: reset to the minimum on activity, doubled when idle
+POLL_MIN_INTERVAL = 3.0
+POLL_MAX_INTERVAL = 60.0
+
+# How long a message is held so the Processor can claim it first (seconds)
+CLAIM_GRACE_SECONDS = 3.0
+
 
 class RealtimeListener:
     """Subscribe to v2_chat_messages INSERTs and send them as iMessages."""
 
-    def __init__(self, config: Config, state: BridgeState) -> None:
+    def __init__(
+        self,
+        config: Config,
+        state: BridgeState,
+        http: httpx.AsyncClient | None = None,
+    ) -> None:
+        """*http* is the shared Supabase client; one is created if omitted."""
         self.config = config
         self.state = state
+        self._http = http
+        self._owns_http = False
         self._supabase = None
         self._channel = None
+        self._stop = asyncio.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # (msg_id, content, loop time the message may be sent from)
+        self._queue: asyncio.Queue[tuple[str, str, float]] = asyncio.Queue()
+        self._consumer: asyncio.Task | None = None
 
     async def start(self) -> None:
         """Connect to Supabase Realtime and subscribe to new messages."""
+        self._loop = asyncio.get_running_loop()
+        self._consumer = asyncio.create_task(self._consume(), name="realtime_consumer")
+
         try:
             from supabase import acreate_client
 
@@ -67,15 +90,14 @@ class RealtimeListener:
             self._channel = channel
             logger.info("Realtime subscription active on v2_chat_messages")
 
-            # Keep alive
-            while True:
-                await asyncio.sleep(3600)
+            # Park until stop() is called
+            await self._stop.wait()
         except Exception:
             logger.exception("Realtime subscription failed, falling back to polling")
             await self._poll_fallback()
 
     def _on_insert(self, payload: dict) -> None:
-        """Handle a Realtime INSERT event (called from websocket thread)."""
+        """Handle a Realtime INSERT event (may be called off the event loop)."""
         try:
             record = payload.get("data", {}).get("record", {})
             if not record:
@@ -105,20 +127,42 @@ class RealtimeListener:
                 content[:80],
             )
 
-            # Schedule the send on the event loop
-            loop = asyncio.get_event_loop()
-            loop.create_task(self._send_and_track(msg_id, content))
+            # Hand off to the consumer on the event loop
+            self._loop.call_soon_threadsafe(self._enqueue, msg_id, content)
         except Exception:
             logger.exception("Error in Realtime callback")
 
-    async def _send_and_track(self, msg_id: str, content: str) -> None:
+    def _enqueue(self, msg_id: str, content: str) -> None:
+        # The grace period runs from arrival, so rows that arrive together
+        # wait it out together rather than one after another
+        not_before = self._loop.time() + CLAIM_GRACE_SECONDS
+        self._queue.put_nowait((msg_id, content, not_before))
+
+    async def _consume(self) -> None:
+        """Send queued Realtime messages one at a time, in arrival order."""
+        while True:
+            msg_id, content, not_before = await self._queue.get()
+            try:
+                await self._send_and_track(msg_id, content, not_before)
+            except Exception:
+                logger.exception("Failed to deliver Realtime message %s", msg_id[:8])
+
+    async def _send_and_track(
+        self, msg_id: str, content: str, not_before: float | None = None
+    ) -> bool:
         """Send an iMessage and mark as sent in state.
 
-        Waits briefly before sending so the Processor (Process 1) has time to
-        claim the message first.  If the Processor already sent it via the
-        fast-path HTTP response, we skip the duplicate.
+        Returns False only if the send failed.  Waits until *not_before*
+        (default: CLAIM_GRACE_SECONDS from now) so the Processor (Process 1)
+        has time to claim the message first.  If the Processor already sent
+        it via the fast-path HTTP response, we skip the duplicate.
         """
-        await asyncio.sleep(3.0)
+        loop = asyncio.get_running_loop()
+        if not_before is None:
+            not_before = loop.time() + CLAIM_GRACE_SECONDS
+        wait = not_before - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
 
         # Re-check after delay — processor may have sent it already
         if msg_id in self.state.sent_message_ids:
@@ -126,14 +170,18 @@ class RealtimeListener:
                 "Realtime: message %s already sent by processor, skipping",
                 msg_id[:8],
             )
-            return
+            return True
 
+        # Claim before the first await so a concurrent delivery of the same
+        # id sees it and skips; released again if the send fails.
+        self.state.sent_message_ids.add(msg_id)
         sent = await send_imessage(self.config.target_phone, content)
         if sent:
-            self.state.sent_message_ids.add(msg_id)
-            self.state.save()
+            self.state.mark_dirty()
         else:
+            self.state.sent_message_ids.discard(msg_id)
             logger.error("Failed to send Realtime message %s via iMessage", msg_id[:8])
+        return sent
 
     async def _catch_up(self) -> None:
         """On startup, mark existing messages as seen so we don't re-send them.
@@ -156,53 +204,91 @@ class RealtimeListener:
                 .execute()
             )
 
-            for r in result.data or []:
-                self.state.sent_message_ids.add(r["id"])
+            rows = result.data or []
+            # Oldest first, so the newest ids are the last to be evicted
+            self.state.sent_message_ids.update(r["id"] for r in reversed(rows))
 
+            # Not marked dirty: catch-up re-runs on every start, so these ids
+            # only need persisting alongside the next real state change.
             logger.info(
                 "Marked %d existing messages as seen (won't re-send)",
-                len(result.data or []),
+                len(rows),
             )
-            self.state.save()
         except Exception:
             logger.exception("Catch-up query failed")
 
     async def _poll_fallback(self) -> None:
-        """Simple polling fallback if Realtime is unavailable."""
-        logger.info("Starting polling fallback (every 3s)")
-        http = httpx.AsyncClient(timeout=30.0)
-        headers = {
-            "apikey": self.config.supabase_service_role_key,
-            "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-        }
+        """Polling fallback if Realtime is unavailable.
+
+        Backs off exponentially while idle and resets to the minimum
+        interval as soon as a poll finds something to send.
+        """
+        logger.info(
+            "Starting polling fallback (every %gs, backing off to %gs when idle)",
+            POLL_MIN_INTERVAL, POLL_MAX_INTERVAL,
+        )
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.config.supabase_url,
+                timeout=30.0,
+                headers={
+                    "apikey": self.config.supabase_service_role_key,
+                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
+                },
+            )
+            self._owns_http = True
+        interval = POLL_MIN_INTERVAL
+
+        # Only fetch rows newer than the last one seen; on first run start
+        # from now rather than replaying history.
+        if not self.state.last_seen_created_at:
+            self.state.last_seen_created_at = datetime.now(timezone.utc).isoformat()
+            self.state.mark_dirty()
 
         while True:
+            found = False
             try:
-                resp = await http.get(
-                    f"{self.config.supabase_url}/rest/v1/v2_chat_messages",
-                    headers=headers,
+                resp = await self._http.get(
+                    "/rest/v1/v2_chat_messages",
                     params={
+                        "select": "id,content,created_at",
                         "user_id": f"eq.{self.config.user_id}",
                         "role": "in.(assistant,system)",
-                        "order": "created_at.desc",
-                        "limit": "10",
+                        "created_at": f"gt.{self.state.last_seen_created_at}",
+                        "order": "created_at.asc",
+                        "limit": "100",
                     },
                 )
                 if resp.status_code == 200:
-                    for r in reversed(resp.json()):
+                    # Rows arrive oldest first; the cursor stops before the
+                    # first failed send so the next poll retries it
+                    cursor = self.state.last_seen_created_at
+                    for r in resp.json():
                         msg_id = r.get("id", "")
                         if msg_id not in self.state.sent_message_ids:
                             content = r.get("content", "")
                             if content:
-                                await self._send_and_track(msg_id, content)
+                                found = True
+                                if not await self._send_and_track(msg_id, content):
+                                    break
+                        cursor = max(cursor, r["created_at"])
+                    if cursor != self.state.last_seen_created_at:
+                        self.state.last_seen_created_at = cursor
+                        self.state.mark_dirty()
             except Exception:
                 logger.debug("Poll fallback error", exc_info=True)
 
-            await asyncio.sleep(3.0)
+            interval = POLL_MIN_INTERVAL if found else min(interval * 2, POLL_MAX_INTERVAL)
+            await asyncio.sleep(interval)
 
     async def stop(self) -> None:
+        self._stop.set()
+        if self._consumer:
+            self._consumer.cancel()
         if self._channel:
             try:
                 await self._channel.unsubscribe()
             except Exception:
                 pass
+        if self._owns_http and self._http:
+            await self._http.aclose()
@@ -1,13 +1,16 @@
 """Outbound iMessage poller.
 
-Polls the outbound_imessages table for pending messages queued by edge
-functions (e.g. post-signup welcome messages) and delivers them via iMessage.
+Delivers pending messages queued in the outbound_imessages table by edge
+functions (e.g. post-signup welcome messages).  New rows arrive via a
+Supabase Realtime subscription; a slow safety poll picks up anything the
+subscription missed (startup backlog, dropped websocket, etc.).
 """
 
 from __future__ import annotations
 
 import asyncio
 import logging
+from datetime import datetime, timezone
 
 import httpx
 
@@ -16,86 +19,213 @@ from .imessage import send_imessage
 
 logger = logging.getLogger("imessage_bridge.sender.outbound_poller")
 
-POLL_INTERVAL_SECONDS = 1
+# Safety-net poll while the Realtime subscription is healthy
+SAFETY_POLL_SECONDS = 60
+# Poll interval when Realtime is unavailable
+FALLBACK_POLL_SECONDS = 1
+# Minimum spacing between consecutive outbound sends
+MIN_SEND_SPACING_SECONDS = 0.5
 
 
 class OutboundPoller:
-    """Poll outbound_imessages for pending messages and send them."""
+    """Send pending outbound_imessages rows as they are inserted."""
 
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, http: httpx.AsyncClient, supabase=None) -> None:
+        """*http* is the shared Supabase client (base URL and auth preset)."""
         self.config = config
-        self._http: httpx.AsyncClient | None = None
-
-    async def run(self) -> None:
-        self._http = httpx.AsyncClient(timeout=15.0)
-        headers = {
-            "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-            "apikey": self.config.supabase_service_role_key,
+        self._http = http
+        self._supabase = supabase
+        self._channel = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue[dict] = asyncio.Queue()
+        self._upsert_headers = {
+            "Content-Type": "application/json",
+            "Prefer": "resolution=merge-duplicates,return=minimal",
         }
+        # Rows queued or being delivered
+        self._pending_ids: set[str] = set()
+        # Rows delivered since the last safety poll (may still read as pending)
+        self._delivered_ids: set[str] = set()
+        self._last_sent_at = 0.0
 
-        logger.info("Outbound poller started (every %ds)", POLL_INTERVAL_SECONDS)
-
-        while True:
-            try:
-                resp = await self._http.get(
-                    f"{self.config.supabase_url}/rest/v1/outbound_imessages",
-                    headers=headers,
-                    params={
-                        "status": "eq.pending",
-                        "order": "created_at.asc",
-                        "limit": "10",
-                    },
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        worker = asyncio.create_task(self._worker(), name="outbound_worker")
+
+        try:
+            poll_interval = (
+                SAFETY_POLL_SECONDS if await self._subscribe() else FALLBACK_POLL_SECONDS
+            )
+            logger.info("Outbound poller started (safety poll every %ds)", poll_interval)
+
+            while True:
+                try:
+                    await self._enqueue_pending()
+                except Exception:
+                    logger.debug("Outbound poll error", exc_info=True)
+                await asyncio.sleep(poll_interval)
+        finally:
+            worker.cancel()
+
+    async def _subscribe(self) -> bool:
+        """Subscribe to outbound_imessages INSERTs.  Returns True on success."""
+        try:
+            if self._supabase is None:
+                from supabase import acreate_client
+
+                self._supabase = await acreate_client(
+                    self.config.supabase_url,
+                    self.config.supabase_service_role_key,
                 )
 
-                if resp.status_code == 200:
-                    rows = resp.json()
-                    for row in rows:
-                        msg_id = row.get("id", "")
-                        phone = row.get("phone_number", "")
-                        content = row.get("content", "")
-
-                        if not phone or not content:
-                            continue
-
-                        logger.info(
-                            "Sending outbound message %s to %s: %s",
-                            msg_id[:8],
-                            phone[:6] + "***",
-                            content[:80],
-                        )
-
-                        sent = await send_imessage(phone, content)
-
-                        from datetime import datetime, timezone
-
-                        new_status = "sent" if sent else "failed"
-                        patch_headers = {
-                            **headers,
-                            "Content-Type": "application/json",
-                        }
-                        patch_body: dict = {"status": new_status}
-                        if sent:
-                            patch_body["sent_at"] = datetime.now(timezone.utc).isoformat()
-
-                        await self._http.patch(
-                            f"{self.config.supabase_url}/rest/v1/outbound_imessages",
-                            headers=patch_headers,
-                            params={"id": f"eq.{msg_id}"},
-                            json=patch_body,
-                        )
-
-                        if sent:
-                            logger.info("Outbound message %s sent", msg_id[:8])
-                        else:
-                            logger.error("Outbound message %s failed", msg_id[:8])
-
-                        await asyncio.sleep(0.5)
+            channel = self._supabase.realtime.channel("outbound-imessages")
+            channel.on_postgres_changes(
+                event="INSERT",
+                schema="public",
+                table="outbound_imessages",
+                filter="status=eq.pending",
+                callback=self._on_row,
+            )
+            await channel.subscribe()
+            self._channel = channel
+            logger.info("Realtime subscription active on outbound_imessages")
+            return True
+        except ImportError:
+            logger.warning(
+                "supabase package not available; outbound Realtime disabled. "
+                "Install with: pip install supabase"
+            )
+        except Exception:
+            logger.exception("Outbound Realtime subscription failed, falling back to polling")
+        return False
+
+    def _on_row(self, payload: dict) -> None:
+        """Handle a Realtime INSERT event (may be called off the event loop)."""
+        record = payload.get("data", {}).get("record", {})
+        if not record:
+            record = payload.get("new", {})
+        if record and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._enqueue, record)
+
+    def _enqueue(self, row: dict) -> None:
+        msg_id = row.get("id", "")
+        if not msg_id or msg_id in self._pending_ids or msg_id in self._delivered_ids:
+            return
+        self._pending_ids.add(msg_id)
+        self._queue.put_nowait(row)
+
+    async def _enqueue_pending(self) -> None:
+        """Queue any rows still pending (safety net for missed Realtime events)."""
+        resp = await self._http.get(
+            "/rest/v1/outbound_imessages",
+            params={
+                "status": "eq.pending",
+                "order": "created_at.asc",
+                "limit": "10",
+            },
+        )
+        if resp.status_code != 200:
+            return
+
+        rows = resp.json()
+        # Forget delivered rows once they no longer read back as pending
+        self._delivered_ids &= {row.get("id", "") for row in rows}
+        for row in rows:
+            self._enqueue(row)
+
+    async def _worker(self) -> None:
+        while True:
+            # Drain everything queued so status updates go out in one request
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            updates: list[dict] = []
+            for row in batch:
+                msg_id = row.get("id", "")
+                try:
+                    update = await self._deliver(row)
+                    if update:
+                        updates.append(update)
+                except Exception:
+                    logger.exception("Outbound delivery failed for %s", msg_id[:8])
+                    updates.append({
+                        "id": msg_id,
+                        "phone_number": row.get("phone_number", ""),
+                        "content": row.get("content", ""),
+                        "status": "failed",
+                        "sent_at": None,
+                    })
 
-            except Exception:
-                logger.debug("Outbound poll error", exc_info=True)
+            try:
+                await self._write_statuses(updates)
+            finally:
+                for row in batch:
+                    self._pending_ids.discard(row.get("id", ""))
+                # Only rows given a status stop reading as pending; the rest
+                # are picked up again by the next safety poll
+                self._delivered_ids.update(update["id"] for update in updates)
+
+    async def _deliver(self, row: dict) -> dict | None:
+        """Send one row.  Returns the status update to persist, if any."""
+        msg_id = row.get("id", "")
+        phone = row.get("phone_number", "")
+        content = row.get("content", "")
+
+        if not phone or not content:
+            return None
+
+        logger.info(
+            "Sending outbound message %s to %s: %s",
+            msg_id[:8],
+            phone[:6] + "***",
+            content[:80],
+        )
+
+        # Only wait out whatever remains of the spacing since the last send
+        wait = self._last_sent_at + MIN_SEND_SPACING_SECONDS - self._loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        sent = await send_imessage(phone, content)
+        self._last_sent_at = self._loop.time()
+        sent_at = datetime.now(timezone.utc).isoformat() if sent else None
+
+        if sent:
+            logger.info("Outbound message %s sent", msg_id[:8])
+        else:
+            logger.error("Outbound message %s failed", msg_id[:8])
+
+        # Upserts must carry the NOT NULL columns and uniform keys per row
+        return {
+            "id": msg_id,
+            "phone_number": phone,
+            "content": content,
+            "status": "sent" if sent else "failed",
+            "sent_at": sent_at,
+        }
 
-            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+    async def _write_statuses(self, updates: list[dict]) -> None:
+        """Persist delivery statuses with a single bulk upsert."""
+        if not updates:
+            return
+        try:
+            resp = await self._http.post(
+                "/rest/v1/outbound_imessages",
+                headers=self._upsert_headers,
+                json=updates,
+            )
+            if resp.status_code >= 400:
+                logger.error(
+                    "Failed to update %d outbound status(es): %s",
+                    len(updates), resp.text[:200],
+                )
+        except Exception:
+            logger.exception("Failed to update %d outbound status(es)", len(updates))
 
     async def close(self) -> None:
-        if self._http:
-            await self._http.aclose()
+        if self._channel:
+            try:
+                await self._channel.unsubscribe()
+            except Exception:
+                pass
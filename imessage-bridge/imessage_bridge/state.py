@@ -1,49 +1,154 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
+import os
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass, field
 from pathlib import Path
 
 logger = logging.getLogger("imessage_bridge.state")
 
-DEFAULT_STATE_DIR = Path.home() / ".config" / "imessage-bridge"
 STATE_FILENAME = "state.json"
 
 # Cap set sizes to prevent unbounded growth
 MAX_PROCESSED_GUIDS = 500
 MAX_SENT_IDS = 200
+# Most recent meeting-prep event IDs remembered per user
+MAX_FIRED_EVENT_IDS = 100
+
+
+def default_state_dir() -> Path:
+    return Path.home() / ".config" / "imessage-bridge"
+
+
+class BoundedSet:
+    """Insertion-ordered set that evicts its oldest entries past *maxlen*."""
+
+    def __init__(self, maxlen: int, items: Iterable[str] = ()) -> None:
+        self.maxlen = maxlen
+        self._od: OrderedDict[str, None] = OrderedDict()
+        self.update(items)
+
+    def add(self, item: str) -> None:
+        self._od[item] = None
+        self._od.move_to_end(item)
+        if len(self._od) > self.maxlen:
+            self._od.popitem(last=False)
+
+    def update(self, items: Iterable[str]) -> None:
+        for item in items:
+            self.add(item)
+
+    def discard(self, item: str) -> None:
+        self._od.pop(item, None)
+
+    def __contains__(self, item: object) -> bool:
+        return item in self._od
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._od)
+
+    def __len__(self) -> int:
+        return len(self._od)
+
+    def __repr__(self) -> str:
+        return f"BoundedSet(maxlen={self.maxlen}, size={len(self._od)})"
 
 
 @dataclass
 class BridgeState:
     last_rowid: int = 0
-    processed_guids: set[str] = field(default_factory=set)
-    sent_message_ids: set[str] = field(default_factory=set)
-    _state_path: Path = field(default=DEFAULT_STATE_DIR / STATE_FILENAME, repr=False)
+    processed_guids: BoundedSet = field(
+        default_factory=lambda: BoundedSet(MAX_PROCESSED_GUIDS)
+    )
+    sent_message_ids: BoundedSet = field(
+        default_factory=lambda: BoundedSet(MAX_SENT_IDS)
+    )
+    # created_at of the newest v2_chat_messages row seen by the poll fallback
+    last_seen_created_at: str = ""
+    # user_id -> meeting-prep event IDs already sent, so a restart doesn't
+    # send them again
+    fired_event_ids: dict[str, BoundedSet] = field(default_factory=dict)
+    _state_path: Path | None = field(default=None, repr=False)
+    _dirty: bool = field(default=False, init=False, repr=False)
+    _save_lock: asyncio.Lock = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self._state_path is None:
+            self._state_path = default_state_dir() / STATE_FILENAME
+        self._save_lock = asyncio.Lock()
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def mark_dirty(self) -> None:
+        """Schedule a save on the next periodic flush instead of writing now."""
+        self._dirty = True
+
+    async def save(self) -> None:
+        """Snapshot the state and write it atomically off the event loop."""
+        async with self._save_lock:
+            # Cleared before the snapshot so marks made during the write keep
+            # the state dirty; restored below if the write doesn't complete
+            self._dirty = False
+            data = {
+                "last_rowid": self.last_rowid,
+                "processed_guids": list(self.processed_guids),
+                "sent_message_ids": list(self.sent_message_ids),
+                "last_seen_created_at": self.last_seen_created_at,
+                "fired_event_ids": {
+                    user_id: list(fired)
+                    for user_id, fired in self.fired_event_ids.items()
+                },
+            }
+            write = asyncio.ensure_future(asyncio.to_thread(self._write_json, data))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # The thread keeps writing the tmp file; hold the lock until
+                # it is done so the next save can't race it
+                try:
+                    await write
+                except Exception:
+                    self._dirty = True
+                raise
+            except BaseException:
+                self._dirty = True
+                raise
+        logger.debug("State saved (last_rowid=%d)", data["last_rowid"])
 
-    def save(self) -> None:
+    def _write_json(self, data: dict) -> None:
         self._state_path.parent.mkdir(parents=True, exist_ok=True)
-        data = {
-            "last_rowid": self.last_rowid,
-            "processed_guids": list(self.processed_guids)[-MAX_PROCESSED_GUIDS:],
-            "sent_message_ids": list(self.sent_message_ids)[-MAX_SENT_IDS:],
-        }
         tmp = self._state_path.with_suffix(".tmp")
-        tmp.write_text(json.dumps(data, indent=2))
-        tmp.replace(self._state_path)
-        logger.debug("State saved (last_rowid=%d)", self.last_rowid)
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._state_path)
 
     @classmethod
-    def load(cls, state_dir: Path = DEFAULT_STATE_DIR) -> BridgeState:
-        path = state_dir / STATE_FILENAME
+    def load(cls, state_dir: Path | None = None) -> BridgeState:
+        path = (state_dir or default_state_dir()) / STATE_FILENAME
         if path.exists():
             try:
                 data = json.loads(path.read_text())
                 state = cls(
                     last_rowid=data.get("last_rowid", 0),
-                    processed_guids=set(data.get("processed_guids", [])),
-                    sent_message_ids=set(data.get("sent_message_ids", [])),
+                    processed_guids=BoundedSet(
+                        MAX_PROCESSED_GUIDS, data.get("processed_guids", [])
+                    ),
+                    sent_message_ids=BoundedSet(
+                        MAX_SENT_IDS, data.get("sent_message_ids", [])
+                    ),
+                    last_seen_created_at=data.get("last_seen_created_at", ""),
+                    fired_event_ids={
+                        user_id: BoundedSet(MAX_FIRED_EVENT_IDS, ids)
+                        for user_id, ids in data.get("fired_event_ids", {}).items()
+                    },
                     _state_path=path,
                 )
                 logger.info(
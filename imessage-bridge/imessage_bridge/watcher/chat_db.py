@@ -5,30 +5,80 @@ from __future__ import annotations
 import logging
 import re
 import sqlite3
+import sys
+import threading
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 logger = logging.getLogger("imessage_bridge.watcher.chat_db")
 
-# Carrier / system notification patterns to skip at the DB level
-_CARRIER_PATTERNS: list[re.Pattern[str]] = [
-    re.compile(r"your voicemail", re.IGNORECASE),
-    re.compile(r"minutes remaining", re.IGNORECASE),
-    re.compile(r"data usage", re.IGNORECASE),
-    re.compile(r"account balance", re.IGNORECASE),
-    re.compile(r"^You have \d+ new", re.IGNORECASE),
-    re.compile(r"your plan has been", re.IGNORECASE),
-    re.compile(r"reply STOP to", re.IGNORECASE),
-    re.compile(r"service notification", re.IGNORECASE),
-    re.compile(r"verification code", re.IGNORECASE),
-    re.compile(r"^Your .+ code is", re.IGNORECASE),
-]
+# Carrier / system notification patterns to skip at the DB level.  Most are
+# plain substrings; two only count at the very start of the message.
+_CARRIER_LITERALS = (
+    "your voicemail",
+    "minutes remaining",
+    "data usage",
+    "account balance",
+    "your plan has been",
+    "reply stop to",
+    "service notification",
+    "verification code",
+)
+_CARRIER_ANCHORED = r"You have \d+ new|Your .+ code is"
+
+# Everything combined into one alternation so a message costs a single scan.
+# Without multiline mode the ``^`` branch only matches at the start of the text.
+_CARRIER_PATTERN = "(?i)" + "|".join(_CARRIER_LITERALS) + f"|^(?:{_CARRIER_ANCHORED})"
+
+try:
+    # RE2 compiles the alternation to a DFA; optional (pip install google-re2)
+    import re2
+
+    _CARRIER_RE = re2.compile(_CARRIER_PATTERN)
+except ImportError:
+    try:
+        # Next best: the regex module's literal-prefix acceleration
+        import regex
+
+        _CARRIER_RE = regex.compile(_CARRIER_PATTERN, regex.V0)
+    except ImportError:
+        _CARRIER_RE = re.compile(_CARRIER_PATTERN)
+_carrier_search = _CARRIER_RE.search
+
+try:
+    # Aho-Corasick over the literals first; optional (pip install pyahocorasick)
+    import ahocorasick
+
+    _CARRIER_AUTOMATON = ahocorasick.Automaton()
+    for _needle in _CARRIER_LITERALS:
+        _CARRIER_AUTOMATON.add_word(_needle, _needle)
+    _CARRIER_AUTOMATON.make_automaton()
+    _carrier_anchored_match = re.compile(_CARRIER_ANCHORED, re.IGNORECASE).match
+except ImportError:
+    _CARRIER_AUTOMATON = None
+
+
+# Pre-filter for the SQL queries: drops plain-text rows that are too short or
+# contain a carrier literal before they are marshalled into Python.  It only
+# rejects rows the Python checks below would reject anyway (LIKE is ASCII
+# case-insensitive), so the attributedBody path and anchored patterns still
+# run in fetch_new_messages.  Empty text falls through to attributedBody.
+_TEXT_FILTER_SQL = (
+    "AND (m.text IS NULL OR m.text = '' OR (length(trim(m.text)) > 1"
+    + "".join(f" AND m.text NOT LIKE '%{needle}%'" for needle in _CARRIER_LITERALS)
+    + "))"
+)
 
 
 def _is_carrier_notification(text: str) -> bool:
     """Return True if text matches known carrier/system notification patterns."""
-    return any(p.search(text) for p in _CARRIER_PATTERNS)
+    if _CARRIER_AUTOMATON is None:
+        return _carrier_search(text) is not None
+    if next(_CARRIER_AUTOMATON.iter(text.lower()), None) is not None:
+        return True
+    return _carrier_anchored_match(text) is not None
+
 
 # Apple Core Data epoch: 2001-01-01 00:00:00 UTC
 _APPLE_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
@@ -48,6 +98,20 @@ def apple_timestamp_to_datetime(nanoseconds: int) -> datetime:
     return _APPLE_EPOCH + timedelta(seconds=nanoseconds / 1_000_000_000)
 
 
+# Reaction artifacts: a single character, or only the punctuation/symbols
+# left behind by tapbacks.  Used with fullmatch, which bails out at the
+# first ordinary character of a real message.
+_TAPBACK_RE = re.compile(r"(?s).|[+\u200d\u200b\u00a0!?.,;:\-_=/]+")
+_tapback_fullmatch = _TAPBACK_RE.fullmatch
+
+# Printable ASCII followed by at least one more printable / UTF-8 / whitespace
+# byte, starting within 120 bytes of the match position.  The lazy skip keeps
+# the whole scan (window bound included) inside the regex engine.
+_PRINTABLE_RUN_RE = re.compile(
+    rb"[\x00-\xff]{0,119}?([\x20-\x7e][\x09\x0a\x0d\x20-\xff]+)"
+)
+
+
 def extract_text_from_attributed_body(blob: bytes) -> str | None:
     """Extract plain text from an NSAttributedString binary blob.
 
@@ -69,143 +133,176 @@ def extract_text_from_attributed_body(blob: bytes) -> str | None:
         else:
             return None
 
-        # Scan forward from the marker looking for the first printable run.
-        search_from = idx + len(marker)
-        for i in range(search_from, min(search_from + 120, len(blob))):
-            b_val = blob[i]
-            if b_val >= 0x20 and b_val < 0x7F:
-                # Looks like the start of readable text.
-                text_bytes = bytearray()
-                for j in range(i, len(blob)):
-                    v = blob[j]
-                    if v == 0x00:
-                        break
-                    # Accept printable ASCII + common whitespace
-                    if v >= 0x20 or v in (0x0A, 0x0D, 0x09):
-                        text_bytes.append(v)
-                    else:
-                        # Non-printable byte — try UTF-8 multi-byte
-                        if v >= 0x80:
-                            text_bytes.append(v)
-                        else:
-                            break
-                if len(text_bytes) > 1:
-                    return text_bytes.decode("utf-8", errors="replace").strip()
+        # The text is the first run that starts with printable ASCII within
+        # 120 bytes of the marker and continues through printable, UTF-8
+        # or whitespace bytes until a NUL or other control byte.
+        match = _PRINTABLE_RUN_RE.match(blob, idx + len(marker))
+        if match:
+            return match.group(1).decode("utf-8", errors="replace").strip()
         return None
     except Exception:
         logger.debug("Failed to extract attributedBody text", exc_info=True)
         return None
 
 
+# Incoming-message queries, built once so every call passes sqlite3 the
+# same text and hits its prepared-statement cache.  attributedBody is only
+# read when the text column is empty.  The ROWID range is bounded above by
+# a MAX(ROWID) read first, so rows filtered out in SQL still advance the
+# cursor.
+_SQL_SELECT = f"""
+    SELECT m.ROWID,
+           m.guid,
+           m.text,
+           CASE WHEN m.text IS NULL OR m.text = ''
+                THEN m.attributedBody END,
+           m.date,
+           h.id AS sender
+    FROM message m
+    JOIN handle h ON m.handle_id = h.ROWID
+    WHERE m.is_from_me = 0
+      AND m.ROWID > ?
+      AND m.ROWID <= ?
+      {_TEXT_FILTER_SQL}
+"""
+_SQL_ALL = _SQL_SELECT + "    ORDER BY m.ROWID ASC\n"
+_SQL_WITH_PHONE = _SQL_SELECT + "      AND h.id = ?\n    ORDER BY m.ROWID ASC\n"
+_SQL_MAX_ROWID = "SELECT MAX(ROWID) FROM message"
+
+# Page-cache tuning for the long-lived chat.db connection
+_MMAP_SIZE = 256 * 1024 * 1024
+_CACHE_SIZE_KIB = 64 * 1024
+
+# Read-only connection reused across fetches (opened lazily, see _get_conn)
+_conn: sqlite3.Connection | None = None
+_conn_path: Path | None = None
+# Held while the connection is opened, used or closed.  Fetches run on a
+# worker thread, so close_chat_db() waits for one still in progress.
+_conn_lock = threading.RLock()
+
+
+def _get_conn(chat_db_path: Path) -> sqlite3.Connection:
+    """Return the cached read-only connection to *chat_db_path*, opening it once.
+
+    The database is opened in **read-only** WAL mode so we never conflict
+    with Messages.app, which holds the write lock.  Each query runs in
+    autocommit, so later calls still see rows committed in between.
+    Callers hold _conn_lock.
+    """
+    global _conn, _conn_path
+    if _conn is None or _conn_path != chat_db_path:
+        close_chat_db()
+        uri = f"file:{chat_db_path}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA query_only=ON")
+            # Map the (often multi-hundred-MB) file and keep the message
+            # index pages cached between polls
+            conn.execute(f"PRAGMA mmap_size={_MMAP_SIZE}")
+            conn.execute(f"PRAGMA cache_size=-{_CACHE_SIZE_KIB}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+        except sqlite3.Error:
+            conn.close()
+            raise
+        _conn, _conn_path = conn, chat_db_path
+    return _conn
+
+
+def close_chat_db() -> None:
+    """Close the cached chat.db connection (safe to call when none is open)."""
+    global _conn, _conn_path
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn, _conn_path = None, None
+
+
 def get_max_rowid(chat_db_path: Path) -> int:
     """Return the current maximum ROWID in chat.db.
 
     Used on first startup to skip all historical messages and only
     process messages that arrive *after* the bridge starts.
     """
-    uri = f"file:{chat_db_path}?mode=ro"
-    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
-    try:
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA query_only=ON")
-        row = conn.execute("SELECT MAX(ROWID) FROM message").fetchone()
-        max_id = row[0] if row and row[0] else 0
-        logger.info("Current chat.db max ROWID: %d", max_id)
-        return max_id
-    finally:
-        conn.close()
+    with _conn_lock:
+        conn = _get_conn(chat_db_path)
+        try:
+            row = conn.execute(_SQL_MAX_ROWID).fetchone()
+        except sqlite3.Error:
+            close_chat_db()
+            raise
+    max_id = row[0] if row and row[0] else 0
+    logger.info("Current chat.db max ROWID: %d", max_id)
+    return max_id
 
 
 def fetch_new_messages(
     chat_db_path: Path,
     target_phone: str | None,
     last_rowid: int,
-) -> list[IncomingMessage]:
+) -> tuple[list[IncomingMessage], int]:
     """Query chat.db for new incoming messages.
 
     If *target_phone* is provided, only fetch from that number.
     If None, fetch from ALL senders (multi-user mode).
 
-    Opens the database in **read-only** WAL mode so we never conflict with
-    Messages.app which holds the write lock.
+    Returns ``(messages, max_rowid)`` where *max_rowid* is the highest
+    ROWID in chat.db when the fetch started.  Every row up to it has been
+    considered, including ones dropped by the SQL pre-filter or the checks
+    below, so the caller can advance past them without re-reading them
+    next tick.
+
+    Reuses one read-only connection across calls; it is dropped on any
+    SQLite error so the next call reopens it.
     """
-    uri = f"file:{chat_db_path}?mode=ro"
-    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
-    try:
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA query_only=ON")
-
-        if target_phone:
-            cursor = conn.execute(
-                """
-                SELECT m.ROWID,
-                       m.guid,
-                       m.text,
-                       m.attributedBody,
-                       m.date,
-                       h.id AS sender
-                FROM message m
-                JOIN handle h ON m.handle_id = h.ROWID
-                WHERE h.id = ?
-                  AND m.is_from_me = 0
-                  AND m.ROWID > ?
-                ORDER BY m.ROWID ASC
-                """,
-                (target_phone, last_rowid),
-            )
-        else:
-            cursor = conn.execute(
-                """
-                SELECT m.ROWID,
-                       m.guid,
-                       m.text,
-                       m.attributedBody,
-                       m.date,
-                       h.id AS sender
-                FROM message m
-                JOIN handle h ON m.handle_id = h.ROWID
-                WHERE m.is_from_me = 0
-                  AND m.ROWID > ?
-                ORDER BY m.ROWID ASC
-                """,
-                (last_rowid,),
-            )
+    with _conn_lock:
+        conn = _get_conn(chat_db_path)
+        try:
+            row = conn.execute(_SQL_MAX_ROWID).fetchone()
+            max_rowid = max(last_rowid, row[0] or 0)
+            if max_rowid == last_rowid:
+                return [], last_rowid
+
+            if target_phone:
+                stmt, params = _SQL_WITH_PHONE, (last_rowid, max_rowid, target_phone)
+            else:
+                stmt, params = _SQL_ALL, (last_rowid, max_rowid)
+            cursor = conn.execute(stmt, params)
+
+            messages: list[IncomingMessage] = []
+            for rowid, guid, text, attributed_body, date_ns, sender in cursor:
+                # Prefer text column; fall back to attributedBody for rich messages
+                msg_text = text
+                if not msg_text and attributed_body:
+                    msg_text = extract_text_from_attributed_body(attributed_body)
 
-        messages: list[IncomingMessage] = []
-        for rowid, guid, text, attributed_body, date_ns, sender in cursor.fetchall():
-            # Prefer text column; fall back to attributedBody for rich messages
-            msg_text = text
-            if not msg_text and attributed_body:
-                msg_text = extract_text_from_attributed_body(attributed_body)
-
-            if not msg_text or not msg_text.strip():
-                continue  # Skip empty messages (tapbacks, reactions, read receipts)
-
-            cleaned = msg_text.strip()
-            # Skip single-character messages and reaction artifacts
-            if len(cleaned) <= 1:
-                continue
-            # Skip messages that are just punctuation/symbols (tapback artifacts)
-            if all(c in "+\u200d\u200b\u00a0!?.,;:-_=/" for c in cleaned):
-                continue
-            # Skip carrier/system notifications (OTP codes, data alerts, etc.)
-            if _is_carrier_notification(cleaned):
-                logger.debug("Skipping carrier notification: %s", cleaned[:60])
-                continue
-
-            messages.append(
-                IncomingMessage(
-                    rowid=rowid,
-                    guid=guid,
-                    text=msg_text.strip(),
-                    sender=sender,
-                    timestamp=apple_timestamp_to_datetime(date_ns),
+                if not msg_text or not msg_text.strip():
+                    continue  # Skip empty messages (tapbacks, reactions, read receipts)
+
+                cleaned = msg_text.strip()
+                # Skip single-character messages and punctuation-only tapback artifacts
+                if _tapback_fullmatch(cleaned):
+                    continue
+                # Skip carrier/system notifications (OTP codes, data alerts, etc.)
+                if _is_carrier_notification(cleaned):
+                    logger.debug("Skipping carrier notification: %s", cleaned[:60])
+                    continue
+
+                messages.append(
+                    IncomingMessage(
+                        rowid=rowid,
+                        guid=guid,
+                        text=msg_text.strip(),
+                        # A handful of senders repeat across rows; share one str each
+                        sender=sys.intern(sender) if sender else sender,
+                        timestamp=apple_timestamp_to_datetime(date_ns),
+                    )
                 )
-            )
 
-        logger.debug(
-            "Fetched %d new messages (ROWID > %d)", len(messages), last_rowid
-        )
-        return messages
-    finally:
-        conn.close()
+            logger.debug(
+                "Fetched %d new messages (ROWID > %d)", len(messages), last_rowid
+            )
+            return messages, max_rowid
+        except sqlite3.Error:
+            close_chat_db()
+            raise
@@ -4,10 +4,11 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
 from pathlib import Path
 from typing import Callable, Coroutine
 
-from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.events import FileSystemEvent, PatternMatchingEventHandler
 from watchdog.observers import Observer
 
 logger = logging.getLogger("imessage_bridge.watcher.fs_monitor")
@@ -16,53 +17,47 @@ logger = logging.getLogger("imessage_bridge.watcher.fs_monitor")
 _POLL_INTERVAL = 3.0
 
 
-class _ChatDBHandler(FileSystemEventHandler):
-    """Debounced handler that signals the main loop when chat.db changes.
+class _ChatDBHandler(PatternMatchingEventHandler):
+    """Handler that signals the main loop when chat.db changes.
 
     Instead of invoking the callback directly, this sets an asyncio Event
     so the single poll loop processes all changes through one code path.
     This prevents FSEvents and the poll from invoking the callback concurrently.
+    Debouncing happens in the loop, so a burst of events costs no timers.
     """
 
-    def __init__(
-        self,
-        event: asyncio.Event,
-        loop: asyncio.AbstractEventLoop,
-        debounce_seconds: float = 0.5,
-    ) -> None:
+    def __init__(self, event: asyncio.Event, loop: asyncio.AbstractEventLoop) -> None:
+        # Only chat.db and its WAL matter; -shm and attachment churn are
+        # dropped in dispatch() before on_modified is called.
+        super().__init__(patterns=["*chat.db", "*chat.db-wal"], ignore_directories=True)
         self._event = event
         self._loop = loop
-        self._debounce_seconds = debounce_seconds
-        self._pending_handle: asyncio.TimerHandle | None = None
 
     def on_modified(self, event: FileSystemEvent) -> None:
-        src = str(event.src_path)
-        if not (src.endswith("chat.db") or src.endswith("chat.db-wal")):
-            return
-        self._loop.call_soon_threadsafe(self._schedule)
+        # Racy read from the observer thread; at worst one redundant set()
+        if not self._event.is_set():
+            self._loop.call_soon_threadsafe(self._event.set)
 
-    def _schedule(self) -> None:
-        if self._pending_handle is not None:
-            self._pending_handle.cancel()
-        self._pending_handle = self._loop.call_later(
-            self._debounce_seconds, self._fire
-        )
 
-    def _fire(self) -> None:
-        self._pending_handle = None
-        self._event.set()
+_DB_FILENAMES = frozenset({"chat.db", "chat.db-wal", "chat.db-shm"})
 
 
 def _get_db_mtime(messages_dir: Path) -> float:
     """Return the latest mtime across chat.db, chat.db-wal, chat.db-shm."""
     best = 0.0
-    for name in ("chat.db", "chat.db-wal", "chat.db-shm"):
-        try:
-            mt = (messages_dir / name).stat().st_mtime
-            if mt > best:
-                best = mt
-        except OSError:
-            pass
+    try:
+        with os.scandir(messages_dir) as entries:
+            for entry in entries:
+                if entry.name not in _DB_FILENAMES:
+                    continue
+                try:
+                    mt = entry.stat().st_mtime
+                except OSError:
+                    continue  # Removed between listing and stat (e.g. -shm)
+                if mt > best:
+                    best = mt
+    except OSError:
+        pass
     return best
 
 
@@ -80,7 +75,7 @@ async def start_watcher(
     loop = asyncio.get_running_loop()
     change_event = asyncio.Event()
 
-    handler = _ChatDBHandler(change_event, loop, debounce_seconds)
+    handler = _ChatDBHandler(change_event, loop)
     observer = Observer()
     observer.schedule(handler, str(messages_dir), recursive=False)
     observer.daemon = True
@@ -98,6 +93,8 @@ async def start_watcher(
             # Wait for FSEvents signal OR poll timeout — whichever comes first
             try:
                 await asyncio.wait_for(change_event.wait(), timeout=_POLL_INTERVAL)
+                # Let the rest of the write burst land, then coalesce it
+                await asyncio.sleep(debounce_seconds)
                 change_event.clear()
                 logger.debug("FSEvents triggered callback")
             except asyncio.TimeoutError:
@@ -1,20 +1,23 @@
 """Process new iMessages: check user status, onboard new users, forward to V2 agent.
 
-v2 — Concurrent per-user processing. Each user's messages are handled in
-their own asyncio Task so 50 users messaging simultaneously don't queue
-behind each other. Per-user locks prevent reply interleaving within a
+v2 — Concurrent per-user processing. Each user's batch is handled by one of
+a fixed pool of worker tasks so 50 users messaging simultaneously don't
+queue behind each other. Per-user locks prevent reply interleaving within a
 single conversation.
 """
 
 from __future__ import annotations
 
 import asyncio
+import dataclasses
 import json
 import logging
 import random
 import re
 import time
-from collections import defaultdict
+import weakref
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Callable
 
 import httpx
 
@@ -23,13 +26,44 @@ from ..sender.imessage import send_imessage
 from ..state import BridgeState
 from .chat_db import IncomingMessage, fetch_new_messages
 
+try:
+    # Faster parsing of agent events and REST rows, and encoding of request
+    # bodies; optional (pip install orjson).  orjson.JSONDecodeError
+    # subclasses json.JSONDecodeError, so handlers match.
+    from orjson import dumps as _json_dumps
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj: object) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
 logger = logging.getLogger("imessage_bridge.watcher.processor")
 _debug_logger = logging.getLogger("imessage_bridge.debug")
 
 _DEBUG_PHONE = "+61414187820"
 
+# Agent concurrency starts here and adapts between the min and max below
 MAX_CONCURRENT_AGENTS = 20
+MIN_AGENT_CONCURRENCY = 4
+MAX_AGENT_CONCURRENCY = 64
 USER_QUEUE_TIMEOUT = 300.0
+# Workers draining per-sender batches, and the batch queue bound
+USER_WORKERS = MAX_AGENT_CONCURRENCY
+USER_QUEUE_MAXSIZE = 1000
+# Send a canned ack if a message is still queued for the agent limiter
+# after this long
+ACK_FALLBACK_DELAY = 1.5
+
+# REST lookups answer quickly; agent calls may sit silent while the model
+# works, so they get the long read timeout per request
+_HTTP_TIMEOUT = httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=10.0)
+_AGENT_TIMEOUT = httpx.Timeout(connect=5.0, read=180.0, write=30.0, pool=10.0)
+
+# Per-request headers on top of the client's auth defaults; bodies are
+# pre-encoded with _json_dumps, so the content type is set here
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_PREFER_REPRESENTATION = {**_JSON_HEADERS, "Prefer": "return=representation"}
 
 
 def _dbg(phone: str, msg: str, *args: object) -> None:
@@ -39,20 +73,20 @@ def _dbg(phone: str, msg: str, *args: object) -> None:
     _debug_logger.info("🔍 %s", formatted)
 
 
-_JUNK_PATTERNS: list[re.Pattern[str]] = [
-    re.compile(r"^https?://\S+$"),
-    re.compile(r"missed a call", re.IGNORECASE),
-    re.compile(r"didn't leave a message", re.IGNORECASE),
-    re.compile(r"^Liked\s+\"", re.IGNORECASE),
-    re.compile(r"^Loved\s+\"", re.IGNORECASE),
-    re.compile(r"^Laughed at\s+\"", re.IGNORECASE),
-    re.compile(r"^Emphasised\s+\"", re.IGNORECASE),
-    re.compile(r"^Emphasized\s+\"", re.IGNORECASE),
-    re.compile(r"^Disliked\s+\"", re.IGNORECASE),
-    re.compile(r"^Questioned\s+\"", re.IGNORECASE),
-]
-
-_CASUAL_WORDS = {
+# Link-only messages (case-sensitive), missed-call notices and tapback
+# reaction texts, as one alternation so each message is scanned once
+_JUNK_RE = re.compile(
+    r"(?-i:^https?://\S+$)"
+    r"|missed a call"
+    r"|didn't leave a message"
+    r"|^(?:Liked|Loved|Laughed at|Emphasi[sz]ed|Disliked|Questioned)\s+\"",
+    re.IGNORECASE,
+)
+# Cheap necessary conditions for a _JUNK_RE match (casefolded)
+_JUNK_SUBSTRINGS = ("missed a call", "didn't leave a message")
+_JUNK_PREFIXES = ("liked", "loved", "laughed at", "emphasi", "disliked", "questioned")
+
+_CASUAL_WORDS = frozenset({
     "hey", "hi", "hello", "yo", "sup", "hiya", "g'day",
     "thanks", "thank you", "cheers", "ta", "thx",
     "nah", "nope", "no",
@@ -61,71 +95,283 @@ _CASUAL_WORDS = {
     "lol", "haha", "hahaha", "lmao", "nice", "cool", "great", "awesome",
     "bye", "cya", "see ya", "later", "ttyl",
     "how are you", "how's it going", "what's up", "whats up",
-}
+})
 
-_NEVER_CASUAL = {
+_NEVER_CASUAL = frozenset({
     "yes", "yeah", "yep", "yup", "sure", "ok", "okay", "k", "kk",
     "do it", "go ahead", "send", "send it", "go for it", "confirm",
-}
+})
+
+# Words that make an otherwise short message a real request
+_SUBSTANCE = frozenset({
+    "meeting", "email", "note", "calendar", "schedule",
+    "search", "find", "draft", "transcript", "summary",
+    "send", "book", "create", "delete", "cancel", "remind",
+    "update", "reschedule", "forward", "reply",
+})
+
+# Same as .strip().rstrip("!?.").strip() in one pass: leading whitespace,
+# then trailing whitespace, the run of !?. before it and whitespace before that
+_CASUAL_STRIP_RE = re.compile(r"^\s+|\s*[!?.]*\s*\Z")
+
+# Longest stripped text _is_casual can accept: a listed phrase, or a short
+# message of up to 12 characters
+_CASUAL_MAX_LEN = max(12, *map(len, _CASUAL_WORDS))
 
-_ACK_FALLBACKS = [
+_ACK_FALLBACKS = (
     "One sec.",
     "Checking now.",
     "Let me look into that.",
     "On it.",
     "Looking into it.",
-]
+)
+
+# Private generator so ack picks don't touch the shared module-level RNG
+_ack_choice = random.Random().choice
 
 
 def _is_junk_message(text: str) -> bool:
-    return any(p.search(text) for p in _JUNK_PATTERNS)
+    # Plain substring/prefix checks on the casefolded text rule out most
+    # messages far faster than the IGNORECASE scan.  They hold whenever the
+    # regex could match, except that re also folds U+0130/U+0131 to "i",
+    # so texts containing those always go to the regex.
+    folded = text.casefold()
+    if (
+        text.startswith("http")
+        or folded.startswith(_JUNK_PREFIXES)
+        or any(needle in folded for needle in _JUNK_SUBSTRINGS)
+        or "\u0130" in text
+        or "\u0131" in text
+    ):
+        return _JUNK_RE.search(text) is not None
+    return False
 
 
 def _is_casual(text: str) -> bool:
-    cleaned = text.lower().strip().rstrip("!?.").strip()
+    # Stripping commutes with lower(), which never shortens text, so long
+    # messages are rejected before paying for the lowercase copy
+    cleaned = _CASUAL_STRIP_RE.sub("", text)
+    if len(cleaned) > _CASUAL_MAX_LEN:
+        return False
+    cleaned = cleaned.lower()
     if cleaned in _NEVER_CASUAL:
         return False
     if cleaned in _CASUAL_WORDS:
         return True
     words = cleaned.split()
     if len(words) <= 2 and len(cleaned) <= 12:
-        substance = {"meeting", "email", "note", "calendar", "schedule",
-                     "search", "find", "draft", "transcript", "summary",
-                     "send", "book", "create", "delete", "cancel", "remind",
-                     "update", "reschedule", "forward", "reply"}
-        return not any(w in substance for w in words)
+        return _SUBSTANCE.isdisjoint(words)
     return False
 
 
 def _pick_fallback_ack() -> str:
-    return random.choice(_ACK_FALLBACKS)
+    return _ack_choice(_ACK_FALLBACKS)
+
+
+# ── PDL profile fields ────────────────────────────────────────
+
+def _pdl_list(value: object) -> str | None:
+    return ", ".join(value) if value and isinstance(value, list) else None
+
+
+def _pdl_company(p: dict) -> str | None:
+    company = p.get("job_company_name")
+    if not company:
+        return None
+    if p.get("job_company_size"):
+        company += f" ({p['job_company_size']} employees)"
+    if p.get("job_company_type"):
+        company += f" [{p['job_company_type']}]"
+    return company
+
+
+def _pdl_role(p: dict) -> str | None:
+    role = p.get("job_title_role")
+    if role and p.get("job_title_sub_role"):
+        role += f" / {p['job_title_sub_role']}"
+    return role
+
+
+def _pdl_years(p: dict) -> str | None:
+    yoe = p.get("inferred_years_experience")
+    return f"~{yoe}" if yoe is not None else None
+
+
+def _pdl_education(p: dict) -> str | None:
+    edu = p.get("education_school")
+    if not edu:
+        return None
+    if majors := _pdl_list(p.get("education_majors")):
+        edu += f" ({majors})"
+    if degrees := _pdl_list(p.get("education_degrees")):
+        edu += f" — {degrees}"
+    return edu
+
+
+def _pdl_location(p: dict) -> str | None:
+    if p.get("location_name"):
+        return p["location_name"]
+    loc = p.get("location_locality")
+    if loc and p.get("location_region"):
+        loc += f", {p['location_region']}"
+    return loc
+
+
+# (label, extractor) in prompt order; a falsy value skips the line
+_PDL_FIELDS: tuple[tuple[str, Callable[[dict], object]], ...] = (
+    ("Name", lambda p: p.get("full_name")),
+    ("Gender", lambda p: p.get("sex")),
+    ("Current Title", lambda p: p.get("job_title")),
+    ("Company", _pdl_company),
+    ("Company Industry", lambda p: p.get("job_company_industry")),
+    ("Role Category", _pdl_role),
+    ("Seniority", lambda p: _pdl_list(p.get("job_title_levels"))),
+    ("In Current Role Since", lambda p: p.get("job_start_date")),
+    ("Job Description", lambda p: p.get("job_summary")),
+    ("LinkedIn Headline", lambda p: p.get("headline")),
+    ("Personal Industry", lambda p: p.get("industry")),
+    ("Years of Experience", _pdl_years),
+    ("Salary Range", lambda p: p.get("inferred_salary")),
+    ("Previous Companies", lambda p: _pdl_list(p.get("previous_companies"))),
+    ("University", _pdl_education),
+    ("Location", _pdl_location),
+    ("Interests", lambda p: _pdl_list(p.get("interests"))),
+)
 
 
 # ── User status cache ─────────────────────────────────────────
 
+# imessage_users columns needed to route a message, and the extra ones the
+# onboarding conversation reads (history and PDL profile can be large)
+_USER_ROUTE_SELECT = "id,user_id,status,display_name"
+_USER_ONBOARDING_SELECT = (
+    _USER_ROUTE_SELECT + ",onboarding_token,onboard_messages,onboard_count,pdl_profile"
+)
+
+# How long a cached onboarding row's status is trusted after it was read
+# from the table; an older one is re-checked in case the user signed up
+_STATUS_MAX_AGE = 5.0
+
 class _UserCache:
-    def __init__(self, ttl: float = 60.0) -> None:
-        self._cache: dict[str, dict] = {}
-        self._timestamps: dict[str, float] = {}
+    """LRU of user rows by phone; "no such user" entries expire sooner.
+
+    Capped at *maxsize* so a wave of unknown numbers can't grow it without
+    bound or push out the rows of users who are actually talking.
+    """
+
+    def __init__(
+        self, ttl: float = 60.0, negative_ttl: float = 5.0, maxsize: int = 2048
+    ) -> None:
+        # phone -> (expiry on the monotonic clock, row)
+        self._cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
         self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._maxsize = maxsize
 
     def get(self, phone: str) -> dict | None:
-        if phone in self._cache:
-            if time.monotonic() - self._timestamps[phone] < self._ttl:
-                return self._cache[phone]
+        entry = self._cache.get(phone)
+        if entry is None:
+            return None
+        expires, data = entry
+        if time.monotonic() >= expires:
             del self._cache[phone]
-            del self._timestamps[phone]
-        return None
+            return None
+        self._cache.move_to_end(phone)
+        return data
 
     def set(self, phone: str, data: dict) -> None:
-        if data.get("status") != "active":
-            return
-        self._cache[phone] = data
-        self._timestamps[phone] = time.monotonic()
+        ttl = self._ttl if data.get("_exists") else self._negative_ttl
+        self._cache[phone] = (time.monotonic() + ttl, data)
+        self._cache.move_to_end(phone)
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
 
     def invalidate(self, phone: str) -> None:
         self._cache.pop(phone, None)
-        self._timestamps.pop(phone, None)
+
+
+# ── Agent concurrency limiter ─────────────────────────────────
+
+class _AdaptiveLimiter:
+    """Semaphore whose size follows agent latency (AIMD).
+
+    Each fast completion (within 1.5x the EWMA latency) adds a permit up to
+    *maximum* and each slower one removes a permit; a failure or timeout
+    halves the limit.  The limit never drops below *minimum*.  A cancelled
+    call (ok=None) is neutral.  Permits are handed to waiters in FIFO order.
+    """
+
+    _EWMA_ALPHA = 0.1
+    _SLOW_FACTOR = 1.5
+
+    def __init__(self, initial: int, minimum: int, maximum: int) -> None:
+        self._limit = initial
+        self._min = minimum
+        self._max = maximum
+        self._in_flight = 0
+        self._baseline: float | None = None
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def saturated(self) -> bool:
+        """True if acquire() would have to wait."""
+        return bool(self._waiters) or self._in_flight >= self._limit
+
+    async def acquire(self) -> None:
+        if not self._waiters and self._in_flight < self._limit:
+            self._in_flight += 1
+            return
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.cancelled():
+                # _wake may already have popped and skipped it
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            else:
+                # A permit was handed over just as we were cancelled
+                self._in_flight -= 1
+                self._wake()
+            raise
+
+    def release(self, ok: bool | None, elapsed: float) -> None:
+        self._in_flight -= 1
+        if ok is False:
+            new_limit = max(self._min, self._limit // 2)
+            if new_limit < self._limit:
+                logger.warning("Agent concurrency limit %d -> %d", self._limit, new_limit)
+            self._limit = new_limit
+        elif ok:
+            if self._baseline is None:
+                self._baseline = elapsed
+            # Judged against the latency seen so far, before this call
+            # moves the average
+            slow = elapsed > self._baseline * self._SLOW_FACTOR
+            self._baseline += self._EWMA_ALPHA * (elapsed - self._baseline)
+            if slow:
+                if self._limit > self._min:
+                    self._limit -= 1
+                    logger.info("Agent latency up, concurrency limit -> %d", self._limit)
+            elif self._limit < self._max:
+                self._limit += 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < self._limit:
+            fut = self._waiters.popleft()
+            # Cancelled but its task hasn't yet run to remove it
+            if fut.done():
+                continue
+            self._in_flight += 1
+            fut.set_result(None)
 
 
 # ── Processor ─────────────────────────────────────────────────
@@ -135,85 +381,151 @@ class MessageProcessor:
 
     Architecture:
       - on_chat_db_changed() reads new messages, groups by sender, and
-        dispatches each sender's batch as a separate asyncio.Task.
+        queues each sender's batch for a fixed pool of worker tasks.
       - Per-user asyncio.Lock ensures messages from the same sender are
         processed sequentially (preserving conversation order).
-      - A global Semaphore caps concurrent agent HTTP calls.
+      - A global adaptive limiter caps concurrent agent HTTP calls.
       - State (last_rowid, processed_guids) is protected by an asyncio.Lock.
     """
 
     def __init__(self, config: Config, state: BridgeState) -> None:
         self.config = config
         self.state = state
-        self._http = httpx.AsyncClient(timeout=180.0)
+        # One HTTP/2 connection to Supabase multiplexes the REST lookups,
+        # onboarding calls and concurrent agent streams
+        self._http = httpx.AsyncClient(
+            http2=True,
+            timeout=_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=200,
+                max_keepalive_connections=100,
+                keepalive_expiry=60.0,
+            ),
+            headers={
+                "Authorization": f"Bearer {config.supabase_service_role_key}",
+                "apikey": config.supabase_service_role_key,
+            },
+        )
+        self._users_url = f"{config.supabase_url}/rest/v1/imessage_users"
+        self._onboard_chat_url = f"{config.supabase_url}/functions/v1/v2-onboard-chat"
         self._user_cache = _UserCache(ttl=15.0)
+        # Routing lookups in flight, shared by concurrent callers per phone
+        self._user_lookups: dict[str, asyncio.Task] = {}
 
-        self._user_locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
-        self._agent_semaphore = asyncio.Semaphore(MAX_CONCURRENT_AGENTS)
+        # Held strongly only while a sender's batch is running, so locks for
+        # idle senders are collected instead of accumulating forever
+        self._user_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        self._agent_limiter = _AdaptiveLimiter(
+            MAX_CONCURRENT_AGENTS, MIN_AGENT_CONCURRENCY, MAX_AGENT_CONCURRENCY
+        )
         self._state_lock = asyncio.Lock()
-        self._active_tasks: set[asyncio.Task] = set()
+        self._user_queue: asyncio.Queue[tuple[str, list[IncomingMessage]]] = asyncio.Queue(
+            maxsize=USER_QUEUE_MAXSIZE
+        )
+        self._workers: list[asyncio.Task] = []
         self._last_response_ids: dict[str, str | None] = {}
-        self._fetching = False
+        self._busy = False
+        self._dirty = False
 
     async def on_chat_db_changed(self) -> None:
-        if self._fetching:
+        """Fetch and dispatch new messages; single-flight with coalescing.
+
+        A change notification that lands mid-fetch is not dropped: it marks
+        the processor dirty and triggers exactly one more pass afterwards.
+        """
+        if self._busy:
+            self._dirty = True
             return
-        self._fetching = True
+        self._busy = True
         try:
-            messages = fetch_new_messages(
-                chat_db_path=self.config.chat_db_path,
-                target_phone=None,
-                last_rowid=self.state.last_rowid,
-            )
-
-            to_process: list[IncomingMessage] = []
-            for msg in messages:
-                if msg.guid in self.state.processed_guids:
-                    async with self._state_lock:
-                        self.state.last_rowid = max(self.state.last_rowid, msg.rowid)
-                    continue
-
-                if _is_junk_message(msg.text):
-                    logger.debug("Skipping junk [ROWID %d]: %s", msg.rowid, msg.text[:80])
-                    async with self._state_lock:
-                        self.state.last_rowid = msg.rowid
-                        self.state.processed_guids.add(msg.guid)
-                        self.state.save()
-                    continue
-
-                async with self._state_lock:
-                    self.state.last_rowid = msg.rowid
-                    self.state.processed_guids.add(msg.guid)
-                    self.state.save()
-
-                to_process.append(msg)
-
-            if not to_process:
-                return
+            while True:
+                self._dirty = False
+                await self._fetch_and_dispatch()
+                if not self._dirty:
+                    break
+        finally:
+            self._busy = False
+
+    async def _fetch_and_dispatch(self) -> None:
+        # SQLite reads run on a worker thread so in-flight agent streams and
+        # sends aren't stalled; _busy keeps the shared connection single-use.
+        messages, max_rowid = await asyncio.to_thread(
+            fetch_new_messages,
+            chat_db_path=self.config.chat_db_path,
+            target_phone=None,
+            last_rowid=self.state.last_rowid,
+        )
 
-            by_sender: dict[str, list[IncomingMessage]] = defaultdict(list)
-            for msg in to_process:
-                by_sender[msg.sender].append(msg)
+        # processed_guids is only written from here, so reading it
+        # unlocked is safe; state is updated once for the whole batch.
+        to_process: list[IncomingMessage] = []
+        new_guids: list[str] = []
+        for msg in messages:
+            if msg.guid in self.state.processed_guids:
+                continue
+
+            new_guids.append(msg.guid)
+            if _is_junk_message(msg.text):
+                logger.debug("Skipping junk [ROWID %d]: %s", msg.rowid, msg.text[:80])
+                continue
+
+            to_process.append(msg)
+
+        # max_rowid also covers rows the fetch filtered out (tapbacks,
+        # carrier texts) so they aren't read again next tick
+        if new_guids or max_rowid > self.state.last_rowid:
+            async with self._state_lock:
+                self.state.last_rowid = max(self.state.last_rowid, max_rowid)
+                self.state.processed_guids.update(new_guids)
+                self.state.mark_dirty()
+
+        if not to_process:
+            return
 
-            logger.info(
-                "Dispatching %d message(s) from %d user(s) concurrently",
-                len(to_process), len(by_sender),
-            )
+        by_sender: dict[str, list[IncomingMessage]] = defaultdict(list)
+        for msg in to_process:
+            by_sender[msg.sender].append(msg)
 
-            for sender, sender_msgs in by_sender.items():
-                task = asyncio.create_task(
-                    self._process_user_batch(sender, sender_msgs),
-                    name=f"user:{sender}",
-                )
-                self._active_tasks.add(task)
-                task.add_done_callback(self._active_tasks.discard)
+        logger.info(
+            "Dispatching %d message(s) from %d user(s) concurrently",
+            len(to_process), len(by_sender),
+        )
 
-        finally:
-            self._fetching = False
+        # Warm the cache while batches wait for a worker; the worker's own
+        # lookup then joins the request already in flight
+        for sender in by_sender:
+            if self._user_cache.get(sender) is None:
+                self._start_user_lookup(sender)
+
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._user_worker(), name=f"user_worker:{i}")
+                for i in range(USER_WORKERS)
+            ]
+        for item in by_sender.items():
+            await self._user_queue.put(item)
+
+    async def _user_worker(self) -> None:
+        while True:
+            sender, messages = await self._user_queue.get()
+            try:
+                await self._process_user_batch(sender, messages)
+            except Exception:
+                logger.exception("User batch for %s failed", sender)
+            finally:
+                self._user_queue.task_done()
 
     async def _process_user_batch(self, sender: str, messages: list[IncomingMessage]) -> None:
         """Process a batch of messages from a single sender, sequentially and under lock."""
-        async with self._user_locks[sender]:
+        lock = self._user_locks.get(sender)
+        if lock is None:
+            lock = self._user_locks[sender] = asyncio.Lock()
+        async with lock:
+            if len(messages) > 1:
+                messages = await self._coalesce_active(sender, messages)
+
             for msg in messages:
                 logger.info(
                     "New iMessage [ROWID %d] from %s: %s",
@@ -231,12 +543,35 @@ class MessageProcessor:
                 except Exception:
                     logger.exception("Failed to process message %s from %s", msg.guid, sender)
 
+    async def _coalesce_active(
+        self, sender: str, messages: list[IncomingMessage]
+    ) -> list[IncomingMessage]:
+        """Merge an active user's burst of texts into one agent turn.
+
+        Onboarding replies depend on a per-message count, so batches from
+        anyone who isn't active yet are returned unchanged.
+        """
+        try:
+            user_info = await self._get_user_info(sender)
+        except Exception:
+            logger.exception("User lookup failed while batching %s", sender)
+            return messages
+        if not user_info or user_info.get("status") != "active":
+            return messages
+
+        logger.info("Coalescing %d messages from %s into one agent call", len(messages), sender)
+        combined = "\n".join(m.text for m in messages)
+        return [dataclasses.replace(messages[-1], text=combined)]
+
     async def _route_message(self, msg: IncomingMessage) -> None:
         user_info = await self._get_user_info(msg.sender)
 
-        _dbg(msg.sender, "👤 USER LOOKUP: %s",
-             f"status={user_info['status']}, user_id={user_info.get('user_id', 'N/A')}, name={user_info.get('display_name', 'N/A')}"
-             if user_info else "NOT FOUND (new user)")
+        if user_info:
+            _dbg(msg.sender, "👤 USER LOOKUP: status=%s, user_id=%s, name=%s",
+                 user_info["status"], user_info.get("user_id", "N/A"),
+                 user_info.get("display_name", "N/A"))
+        else:
+            _dbg(msg.sender, "👤 USER LOOKUP: NOT FOUND (new user)")
 
         if user_info is None:
             _dbg(msg.sender, "🆕 Routing → _onboard_new_user()")
@@ -253,32 +588,55 @@ class MessageProcessor:
     # ── User Lookup ───────────────────────────────────────────
 
     async def _get_user_info(self, phone: str) -> dict | None:
+        """Return the routing fields for *phone* (cached), or None if unknown."""
         cached = self._user_cache.get(phone)
         if cached is not None:
             return cached if cached.get("_exists") else None
-
+        # Shielded so one caller being cancelled doesn't fail the others
+        return await asyncio.shield(self._start_user_lookup(phone))
+
+    def _start_user_lookup(self, phone: str) -> asyncio.Task:
+        """Return the in-flight routing lookup for *phone*, starting one if needed."""
+        lookup = self._user_lookups.get(phone)
+        if lookup is None:
+            lookup = asyncio.create_task(self._fetch_user(phone, _USER_ROUTE_SELECT))
+            self._user_lookups[phone] = lookup
+            lookup.add_done_callback(lambda _: self._user_lookups.pop(phone, None))
+        return lookup
+
+    async def _get_onboarding_info(self, phone: str) -> dict | None:
+        """Fetch the full onboarding row for *phone*, bypassing the cache."""
+        return await self._fetch_user(phone, _USER_ONBOARDING_SELECT)
+
+    async def _fetch_user(
+        self, phone: str, select: str, cache: bool = True
+    ) -> dict | None:
         try:
             resp = await self._http.get(
-                f"{self.config.supabase_url}/rest/v1/imessage_users",
+                self._users_url,
                 params={
                     "phone_number": f"eq.{phone}",
-                    "select": "id,phone_number,user_id,status,onboarding_token,display_name,onboard_messages,onboard_count,pdl_profile",
-                },
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "apikey": self.config.supabase_service_role_key,
+                    "select": select,
+                    "limit": "1",
                 },
             )
 
-            if resp.status_code == 200:
-                data = resp.json()
-                if data and len(data) > 0:
-                    user = data[0]
-                    user["_exists"] = True
+            if resp.status_code != 200:
+                logger.error("User lookup for %s returned %d", phone, resp.status_code)
+                return None
+
+            data = _json_loads(resp.content)
+            if data:
+                user = data[0]
+                user["_exists"] = True
+                user["_status_at"] = time.monotonic()
+                if cache:
                     self._user_cache.set(phone, user)
-                    return user
+                return user
 
-            self._user_cache.set(phone, {"_exists": False})
+            # Only a definite "no such row" is cached, never a failed request
+            if cache:
+                self._user_cache.set(phone, {"_exists": False})
             return None
         except Exception:
             logger.exception("Failed to look up user %s", phone)
@@ -291,17 +649,12 @@ class MessageProcessor:
 
         try:
             resp = await self._http.post(
-                f"{self.config.supabase_url}/rest/v1/imessage_users",
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "apikey": self.config.supabase_service_role_key,
-                    "Content-Type": "application/json",
-                    "Prefer": "return=representation",
-                },
-                json={
+                self._users_url,
+                headers=_PREFER_REPRESENTATION,
+                content=_json_dumps({
                     "phone_number": msg.sender,
                     "status": "pending",
-                },
+                }),
             )
 
             if resp.status_code == 409 or (resp.status_code >= 400 and "duplicate" in resp.text.lower()):
@@ -318,12 +671,16 @@ class MessageProcessor:
                 logger.error("Failed to create user entry: %s", resp.text[:200])
                 return
 
-            user_data = resp.json()
+            user_data = _json_loads(resp.content)
             if isinstance(user_data, list):
                 user_data = user_data[0]
 
             token = user_data.get("onboarding_token", "")
-            self._user_cache.invalidate(msg.sender)
+            # The representation is the full row, so the next message can
+            # continue onboarding straight from the cache
+            user_data["_exists"] = True
+            user_data["_status_at"] = time.monotonic()
+            self._user_cache.set(msg.sender, user_data)
 
             logger.info("Created imessage_users entry for %s (token=%s)", msg.sender, token[:8])
 
@@ -337,14 +694,32 @@ class MessageProcessor:
     # ── Continue Onboarding Conversation ─────────────────────
 
     async def _continue_onboarding(self, msg: IncomingMessage, user_info: dict) -> None:
-        self._user_cache.invalidate(msg.sender)
-        fresh_info = await self._get_user_info(msg.sender)
-        if fresh_info and fresh_info.get("status") == "active" and fresh_info.get("user_id"):
-            logger.info("User %s completed onboarding since last check, routing as active", msg.sender)
-            await self._process_active_user(msg, fresh_info)
-            return
+        # A full onboarding row from the cache supplies the history.  The
+        # user may have signed up on the web since its status was read, so
+        # an old status is re-checked (routing columns only)
+        if "onboard_messages" in user_info:
+            info = user_info
+            if (
+                info.get("status") not in ("pending", "onboarding")
+                or time.monotonic() - info.get("_status_at", 0.0) >= _STATUS_MAX_AGE
+            ):
+                route_info = await self._fetch_user(msg.sender, _USER_ROUTE_SELECT, cache=False)
+                if route_info and route_info.get("status") == "active" and route_info.get("user_id"):
+                    logger.info("User %s completed onboarding since last check, routing as active", msg.sender)
+                    self._user_cache.set(msg.sender, route_info)
+                    await self._process_active_user(msg, route_info)
+                    return
+                if route_info:
+                    info["status"] = route_info.get("status")
+                    info["_status_at"] = route_info["_status_at"]
+        else:
+            fresh_info = await self._get_onboarding_info(msg.sender)
+            if fresh_info and fresh_info.get("status") == "active" and fresh_info.get("user_id"):
+                logger.info("User %s completed onboarding since last check, routing as active", msg.sender)
+                await self._process_active_user(msg, fresh_info)
+                return
+            info = fresh_info or user_info
 
-        info = fresh_info or user_info
         token = info.get("onboarding_token", "")
         onboard_url = f"https://nest.expert/?token={token}"
         history = info.get("onboard_messages") or []
@@ -359,68 +734,11 @@ class MessageProcessor:
     def _build_pdl_context(pdl_profile: dict | None) -> str | None:
         if not pdl_profile or not isinstance(pdl_profile, dict):
             return None
-        lines: list[str] = []
-        p = pdl_profile
-
-        if p.get("full_name"):
-            lines.append(f"Name: {p['full_name']}")
-        if p.get("sex"):
-            lines.append(f"Gender: {p['sex']}")
-        if p.get("job_title"):
-            lines.append(f"Current Title: {p['job_title']}")
-        if p.get("job_company_name"):
-            company = p["job_company_name"]
-            if p.get("job_company_size"):
-                company += f" ({p['job_company_size']} employees)"
-            if p.get("job_company_type"):
-                company += f" [{p['job_company_type']}]"
-            lines.append(f"Company: {company}")
-        if p.get("job_company_industry"):
-            lines.append(f"Company Industry: {p['job_company_industry']}")
-        if p.get("job_title_role"):
-            role = p["job_title_role"]
-            if p.get("job_title_sub_role"):
-                role += f" / {p['job_title_sub_role']}"
-            lines.append(f"Role Category: {role}")
-        levels = p.get("job_title_levels")
-        if levels and isinstance(levels, list) and len(levels) > 0:
-            lines.append(f"Seniority: {', '.join(levels)}")
-        if p.get("job_start_date"):
-            lines.append(f"In Current Role Since: {p['job_start_date']}")
-        if p.get("job_summary"):
-            lines.append(f"Job Description: {p['job_summary']}")
-        if p.get("headline"):
-            lines.append(f"LinkedIn Headline: {p['headline']}")
-        if p.get("industry"):
-            lines.append(f"Personal Industry: {p['industry']}")
-        yoe = p.get("inferred_years_experience")
-        if yoe is not None:
-            lines.append(f"Years of Experience: ~{yoe}")
-        if p.get("inferred_salary"):
-            lines.append(f"Salary Range: {p['inferred_salary']}")
-        prev = p.get("previous_companies")
-        if prev and isinstance(prev, list) and len(prev) > 0:
-            lines.append(f"Previous Companies: {', '.join(prev)}")
-        if p.get("education_school"):
-            edu = p["education_school"]
-            majors = p.get("education_majors")
-            degrees = p.get("education_degrees")
-            if majors and isinstance(majors, list):
-                edu += f" ({', '.join(majors)})"
-            if degrees and isinstance(degrees, list):
-                edu += f" — {', '.join(degrees)}"
-            lines.append(f"University: {edu}")
-        if p.get("location_name"):
-            lines.append(f"Location: {p['location_name']}")
-        elif p.get("location_locality"):
-            loc = p["location_locality"]
-            if p.get("location_region"):
-                loc += f", {p['location_region']}"
-            lines.append(f"Location: {loc}")
-        interests = p.get("interests")
-        if interests and isinstance(interests, list) and len(interests) > 0:
-            lines.append(f"Interests: {', '.join(interests)}")
-
+        lines = [
+            f"{label}: {value}"
+            for label, extract in _PDL_FIELDS
+            if (value := extract(pdl_profile))
+        ]
         return "\n".join(lines) if lines else None
 
     # ── Onboard Chat Edge Function Call ──────────────────────
@@ -446,12 +764,9 @@ class MessageProcessor:
 
             edge_timeout = 25.0 if message_count <= 1 else 20.0
             resp = await self._http.post(
-                f"{self.config.supabase_url}/functions/v1/v2-onboard-chat",
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
+                self._onboard_chat_url,
+                headers=_JSON_HEADERS,
+                content=_json_dumps(payload),
                 timeout=edge_timeout,
             )
 
@@ -460,12 +775,15 @@ class MessageProcessor:
                 await send_imessage(msg.sender, "Hey, something went wrong on my end. Text me again in a sec.")
                 return
 
-            data = resp.json()
+            data = _json_loads(resp.content)
             response_text = data.get("response", "")
             if not response_text:
+                self._user_cache.invalidate(msg.sender)
                 logger.error("Empty response from v2-onboard-chat")
                 return
 
+            self._record_onboard_turn(msg, history, message_count, response_text)
+
             logger.info("Onboard chat response (%d chars, count=%d): %s", len(response_text), message_count, response_text[:120])
             await send_imessage(msg.sender, response_text)
 
@@ -473,6 +791,33 @@ class MessageProcessor:
             logger.exception("Failed to call v2-onboard-chat for %s", msg.sender)
             await send_imessage(msg.sender, "Hey, something went wrong on my end. Text me again in a sec.")
 
+    def _record_onboard_turn(
+        self, msg: IncomingMessage, history: list, message_count: int, response_text: str
+    ) -> None:
+        """Mirror the edge function's history/count write into the cached row.
+
+        The cache TTL is not renewed, so the row is re-read from the table
+        at least once per TTL.
+
+        A cached trimmed routing row can't be extended and is dropped instead,
+        as is the row after a first message: the edge function may have just
+        stored a PDL profile that later turns need to send back.
+        """
+        cached = self._user_cache.get(msg.sender)
+        if (
+            cached is None
+            or "onboard_messages" not in cached
+            or (message_count <= 1 and not cached.get("pdl_profile"))
+        ):
+            self._user_cache.invalidate(msg.sender)
+            return
+        cached["onboard_messages"] = [
+            *history,
+            {"role": "user", "content": msg.text},
+            {"role": "assistant", "content": response_text},
+        ]
+        cached["onboard_count"] = message_count
+
     # ── Active User Processing ────────────────────────────────
 
     async def _process_active_user(self, msg: IncomingMessage, user_info: dict) -> None:
@@ -489,9 +834,42 @@ class MessageProcessor:
 
         agent_start = time.monotonic()
 
-        async with self._agent_semaphore:
-            _dbg(msg.sender, "💬 Calling agent (streaming)")
-            response_text = await self._forward_to_agent_streaming(msg, user_id, display_name)
+        # A message stuck behind a saturated limiter gets a canned ack rather
+        # than silence; casual texts never got an ack and still don't
+        acked = asyncio.Event()
+        watchdog: asyncio.Task | None = None
+        if self._agent_limiter.saturated and not _is_casual(msg.text):
+            watchdog = asyncio.create_task(self._ack_watchdog(msg.sender, acked))
+        try:
+            await self._agent_limiter.acquire()
+            # Once through the queue the service sends its own ack; a
+            # watchdog that already fired (acked set) is let finish
+            if watchdog is not None and not acked.is_set():
+                watchdog.cancel()
+            call_start = time.monotonic()
+            # None (cancelled, e.g. at shutdown) says nothing about the agent
+            ok: bool | None = False
+            try:
+                _dbg(msg.sender, "💬 Calling agent (streaming)")
+                response_text = await self._forward_to_agent_streaming(
+                    msg, user_id, display_name, acked=acked
+                )
+                ok = True
+            except asyncio.CancelledError:
+                ok = None
+                raise
+            finally:
+                self._agent_limiter.release(ok, time.monotonic() - call_start)
+        finally:
+            # Stops a pending watchdog; one already sending is let finish so
+            # its ack still lands ahead of the reply
+            acked.set()
+            if watchdog is not None:
+                try:
+                    await watchdog
+                except asyncio.CancelledError:
+                    if not watchdog.cancelled():
+                        raise
 
         agent_elapsed = time.monotonic() - agent_start
         _dbg(msg.sender, "⏱ Agent round-trip: %.1fs", agent_elapsed)
@@ -520,6 +898,21 @@ class MessageProcessor:
 
         _dbg(msg.sender, "=" * 70)
 
+    async def _ack_watchdog(self, phone: str, acked: asyncio.Event) -> None:
+        """Send a fallback ack unless *acked* is set within ACK_FALLBACK_DELAY.
+
+        Cancelled once the message gets its limiter permit.
+        """
+        try:
+            await asyncio.wait_for(acked.wait(), timeout=ACK_FALLBACK_DELAY)
+            return
+        except asyncio.TimeoutError:
+            pass
+        acked.set()
+        ack_text = _pick_fallback_ack()
+        _dbg(phone, "⚡ Fallback ACK after %.1fs: \"%s\"", ACK_FALLBACK_DELAY, ack_text)
+        await send_imessage(phone, ack_text)
+
     # ── Agent Communication ───────────────────────────────────
 
     async def _forward_to_agent(
@@ -536,11 +929,9 @@ class MessageProcessor:
 
         resp = await self._http.post(
             self.config.v2_chat_service_url,
-            headers={
-                "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                "Content-Type": "application/json",
-            },
-            json=body,
+            headers=_JSON_HEADERS,
+            content=_json_dumps(body),
+            timeout=_AGENT_TIMEOUT,
         )
 
         req_elapsed = time.monotonic() - req_start
@@ -556,12 +947,14 @@ class MessageProcessor:
         content_type = resp.headers.get("content-type", "")
 
         if "ndjson" in content_type:
-            for line in resp.text.strip().splitlines():
+            # Split the raw bytes: no full-body decode, and only \n/\r end
+            # a line (str.splitlines would also break on U+2028 in a string)
+            for line in resp.content.splitlines():
                 line = line.strip()
                 if not line:
                     continue
                 try:
-                    event = json.loads(line)
+                    event = _json_loads(line)
                 except json.JSONDecodeError:
                     continue
                 if event.get("type") == "ack":
@@ -576,7 +969,7 @@ class MessageProcessor:
                     if debug_info:
                         self._log_debug_info(msg.sender, debug_info)
         else:
-            data = resp.json()
+            data = _json_loads(resp.content)
             response_text = data.get("response", "")
             self._last_response_ids[msg.sender] = data.get("response_id")
             debug_info = data.get("_debug")
@@ -591,12 +984,18 @@ class MessageProcessor:
         return response_text
 
     async def _forward_to_agent_streaming(
-        self, msg: IncomingMessage, user_id: str, display_name: str | None = None
+        self,
+        msg: IncomingMessage,
+        user_id: str,
+        display_name: str | None = None,
+        acked: asyncio.Event | None = None,
     ) -> str | None:
         """POST to v2-chat-service and handle NDJSON streaming.
 
         Streams ack immediately, returns full response text.
         Falls back to standard JSON if the response isn't NDJSON.
+        *acked* is set on the first ack or response; a service ack is
+        dropped if it is already set (the fallback ack went out first).
         """
         self._last_response_ids[msg.sender] = None
 
@@ -611,21 +1010,20 @@ class MessageProcessor:
 
         req_start = time.monotonic()
         response_text: str | None = None
+        # Acks go out while the stream keeps running; awaited before returning
+        # so the ack always lands ahead of the reply
+        ack_task: asyncio.Task | None = None
 
         try:
             async with self._http.stream(
                 "POST",
                 self.config.v2_chat_service_url,
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "Content-Type": "application/json",
-                },
-                json=body,
+                headers=_JSON_HEADERS,
+                content=_json_dumps(body),
+                timeout=_AGENT_TIMEOUT,
             ) as stream:
                 if stream.status_code != 200:
-                    body_text = ""
-                    async for chunk in stream.aiter_text():
-                        body_text += chunk
+                    await stream.aread()
                     _dbg(msg.sender, "❌ Edge function returned HTTP %d (%.1fs)", stream.status_code, time.monotonic() - req_start)
                     raise RuntimeError(f"v2-chat-service error: {stream.status_code}")
 
@@ -633,42 +1031,43 @@ class MessageProcessor:
                 is_ndjson = "ndjson" in content_type
 
                 if is_ndjson:
-                    buffer = ""
-                    async for chunk in stream.aiter_text():
-                        buffer += chunk
-                        while "\n" in buffer:
-                            line, buffer = buffer.split("\n", 1)
-                            line = line.strip()
-                            if not line:
-                                continue
-                            try:
-                                event = json.loads(line)
-                            except json.JSONDecodeError:
-                                logger.warning("Bad NDJSON line: %s", line[:200])
-                                continue
-
-                            event_type = event.get("type")
-
-                            if event_type == "ack":
-                                ack_text = event.get("text", "")
-                                if ack_text:
-                                    _dbg(msg.sender, "⚡ ACK received: \"%s\" (%.1fs)", ack_text, time.monotonic() - req_start)
-                                    await send_imessage(msg.sender, ack_text)
-
-                            elif event_type == "response":
-                                response_text = event.get("response", "")
-                                self._last_response_ids[msg.sender] = event.get("response_id")
-                                debug_info = event.get("_debug")
-                                if debug_info:
-                                    self._log_debug_info(msg.sender, debug_info)
-
-                            elif event_type == "error":
-                                logger.error("Stream error from service: %s", event.get("error"))
+                    async for line in stream.aiter_lines():
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            event = _json_loads(line)
+                        except json.JSONDecodeError:
+                            logger.warning("Bad NDJSON line: %s", line[:200])
+                            continue
+
+                        event_type = event.get("type")
+
+                        if event_type == "ack":
+                            ack_text = event.get("text", "")
+                            if ack_text and acked is not None and acked.is_set():
+                                _dbg(msg.sender, "⚡ ACK dropped, already acknowledged: \"%s\"", ack_text)
+                            elif ack_text:
+                                if acked is not None:
+                                    acked.set()
+                                _dbg(msg.sender, "⚡ ACK received: \"%s\" (%.1fs)", ack_text, time.monotonic() - req_start)
+                                if ack_task is not None:
+                                    await ack_task
+                                ack_task = asyncio.create_task(send_imessage(msg.sender, ack_text))
+
+                        elif event_type == "response":
+                            if acked is not None:
+                                acked.set()
+                            response_text = event.get("response", "")
+                            self._last_response_ids[msg.sender] = event.get("response_id")
+                            debug_info = event.get("_debug")
+                            if debug_info:
+                                self._log_debug_info(msg.sender, debug_info)
+
+                        elif event_type == "error":
+                            logger.error("Stream error from service: %s", event.get("error"))
                 else:
-                    full_body = ""
-                    async for chunk in stream.aiter_text():
-                        full_body += chunk
-                    data = json.loads(full_body)
+                    data = _json_loads(await stream.aread())
                     response_text = data.get("response", "")
                     self._last_response_ids[msg.sender] = data.get("response_id")
                     debug_info = data.get("_debug")
@@ -679,6 +1078,9 @@ class MessageProcessor:
             logger.error("v2-chat-service timed out for %s", msg.sender)
             _dbg(msg.sender, "❌ v2-chat-service TIMED OUT (%.1fs)", time.monotonic() - req_start)
             raise RuntimeError("v2-chat-service timeout")
+        finally:
+            if ack_task is not None:
+                await ack_task
 
         req_elapsed = time.monotonic() - req_start
         _dbg(msg.sender, "🌐 RESPONSE complete (%.1fs)", req_elapsed)
@@ -712,8 +1114,8 @@ class MessageProcessor:
         _dbg(phone, "-" * 50)
 
     async def close(self) -> None:
-        for task in self._active_tasks:
+        for task in self._workers:
             task.cancel()
-        if self._active_tasks:
-            await asyncio.gather(*self._active_tasks, return_exceptions=True)
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
         await self._http.aclose()
@@ -7,19 +7,65 @@ In multi-user mode, fetches all active users and checks triggers for each.
 from __future__ import annotations
 
 import asyncio
+import functools
+import json
 import logging
 import time
-from datetime import datetime, timezone
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
 
 import httpx
 
 from ..config import Config
 from ..sender.imessage import send_imessage
+from ..state import MAX_FIRED_EVENT_IDS, BoundedSet, BridgeState
 
 logger = logging.getLogger("imessage_bridge.watcher.trigger_checker")
 
+try:
+    # Faster parsing of v2-trigger results and REST rows, and encoding of
+    # request bodies; optional (pip install orjson)
+    from orjson import dumps as _json_dumps
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj: object) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+try:
+    # C ISO 8601 parser; optional (pip install ciso8601)
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:
+    # Python 3.11+ accepts the trailing "Z" PostgREST may send
+    _parse_iso = datetime.fromisoformat
+
+
 CHECK_INTERVAL_SECONDS = 60
+# Ceiling for the interval while there are no users to check; kept under the
+# 4-minute meeting-prep window so a newly active user's meetings aren't missed
+MAX_IDLE_INTERVAL_SECONDS = 180
+# Drips wait at least 10 minutes, so they are checked on a slower cadence.
+# Not backed off: the query only returns users already due, so finding
+# none is the normal state rather than a sign nobody is pending
+DRIP_CHECK_INTERVAL_SECONDS = 300
 REQUEST_TIMEOUT = 30.0
+# Users whose meeting-prep triggers are checked at the same time
+TRIGGER_CONCURRENCY = 10
+# Check every user's meeting prep in one v2-trigger call; False falls back
+# to one call per user
+BULK_MEETING_PREP = True
+# The bulk call prepares all users' meetings server-side before answering
+BULK_REQUEST_TIMEOUT = 90.0
+# The bulk call may be held open this long for a meeting to come due
+# (long poll); kept under CHECK_INTERVAL_SECONDS so cron reminders keep
+# their cadence
+LONG_POLL_SECONDS = 50
+# How long the active-user list is reused; kept well under the 4-minute
+# meeting-prep window so newly active users are picked up in time
+ACTIVE_USERS_TTL_SECONDS = 120
+# Minimum gap between two trigger messages to the same phone
+SEND_SPACING_SECONDS = 2.0
 
 # Drip sequence: (step, delay_minutes, message_template)
 # {{URL}} is replaced with the user's onboard URL at send time.
@@ -28,91 +74,284 @@ _DRIP_SEQUENCE: list[tuple[int, int, str]] = [
     (1, 10,
      "still here when you're ready to verify you're human\n\n{{URL}}"),
 ]
+# Send-time form: (step, delay_seconds, template split around {{URL}}), so a
+# message is just onboard_url.join(parts)
+_DRIP_STEPS: tuple[tuple[int, int, tuple[str, ...]], ...] = tuple(
+    (step, delay_minutes * 60, tuple(template.split("{{URL}}")))
+    for step, delay_minutes, template in _DRIP_SEQUENCE
+)
+# No drip is due sooner than this after the last touch
+_MIN_DRIP_DELAY = timedelta(minutes=min(delay for _, delay, _ in _DRIP_SEQUENCE))
+
+# Request bodies are pre-encoded with _json_dumps, so the content type is
+# set per request on top of the client's auth defaults
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_CRON_REMINDERS_BODY = _json_dumps({"action": "check_cron_reminders"})
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_timestamp(raw: str) -> datetime:
+    """Parse a PostgREST timestamp.
+
+    A pending user's reference time only changes when a drip is sent, so
+    most drip ticks parse the same strings again.
+    """
+    return _parse_iso(raw)
 
 
 class TriggerChecker:
     """Periodically checks for meeting triggers and sends prep via iMessage."""
 
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, state: BridgeState) -> None:
         self.config = config
-        self._http = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
-        self._fired_event_ids: dict[str, set[str]] = {}  # user_id -> set of event_ids
+        self.state = state
+        self._users_url = f"{config.supabase_url}/rest/v1/imessage_users"
+        self._drip_rpc_url = f"{config.supabase_url}/rest/v1/rpc/bulk_update_drip_steps"
+        self._trigger_url = f"{config.supabase_url}/functions/v1/v2-trigger"
+        # Every tick hits the same Supabase host; keep one pooled HTTP/2
+        # connection warm between ticks instead of reconnecting per request
+        self._http = httpx.AsyncClient(
+            http2=True,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=90.0,
+            ),
+            headers={
+                "Authorization": f"Bearer {config.supabase_service_role_key}",
+                "apikey": config.supabase_service_role_key,
+            },
+        )
+        # user_id -> most recently fired event_ids, oldest evicted first;
+        # persisted with the bridge state
+        self._fired_event_ids = state.fired_event_ids
+        self._trigger_sem = asyncio.Semaphore(TRIGGER_CONCURRENCY)
+        # Last successful active-user fetch, and user_id -> phone from it
+        self._active_users: list[dict] | None = None
+        self._active_phones: dict[str, str] = {}
+        self._active_users_at = 0.0
+        # Active-user fetch in flight, shared by everyone who needs the list
+        self._active_users_fetch: asyncio.Task[list[dict]] | None = None
+        # phone -> (kind, text) messages waiting to be sent, and the task
+        # draining each queue; a drain exits once its queue stays empty
+        self._send_queues: dict[str, asyncio.Queue[tuple[str, str]]] = {}
+        self._send_tasks: dict[str, asyncio.Task] = {}
         self._running = True
 
     async def run(self) -> None:
-        logger.info("Trigger checker started (interval=%ds)", CHECK_INTERVAL_SECONDS)
+        logger.info(
+            "Trigger checker started (triggers every %ds, drips every %ds)",
+            CHECK_INTERVAL_SECONDS, DRIP_CHECK_INTERVAL_SECONDS,
+        )
+        await asyncio.gather(
+            self._run_every(
+                "Trigger check", self._trigger_tick,
+                CHECK_INTERVAL_SECONDS, MAX_IDLE_INTERVAL_SECONDS,
+            ),
+            self._run_every(
+                "Onboard drip check", self._check_onboard_drips,
+                DRIP_CHECK_INTERVAL_SECONDS, DRIP_CHECK_INTERVAL_SECONDS,
+            ),
+        )
+
+    async def _run_every(
+        self,
+        label: str,
+        check: Callable[[], Awaitable[bool]],
+        interval_seconds: int,
+        max_idle_seconds: int,
+    ) -> None:
+        """Run *check* every *interval_seconds*, backing off while it finds no users."""
+        interval = interval_seconds
 
         while self._running:
+            tick_start = time.monotonic()
+            has_users = False
             try:
-                await self._check_triggers()
+                has_users = await check()
             except Exception:
-                logger.exception("Trigger check failed")
+                logger.exception("%s failed", label)
 
-            try:
-                await self._check_cron_reminders()
-            except Exception:
-                logger.exception("Cron reminder check failed")
-
-            try:
-                await self._check_onboard_drips()
-            except Exception:
-                logger.exception("Onboard drip check failed")
-
-            await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+            # With nobody to check nothing can come due, so back off; any
+            # user resets the normal cadence
+            if has_users:
+                interval = interval_seconds
+            else:
+                interval = min(interval * 2, max_idle_seconds)
 
-    async def _check_triggers(self) -> None:
+            # Ticks start every `interval` seconds however long the checks
+            # took, rather than drifting later by each tick's duration
+            elapsed = time.monotonic() - tick_start
+            if elapsed > interval:
+                logger.warning(
+                    "%s took %.1fs, longer than the %ds interval",
+                    label, elapsed, interval,
+                )
+            await asyncio.sleep(max(0.0, interval - elapsed))
+
+    async def _trigger_tick(self) -> bool:
+        """Meeting prep and cron reminders.  Returns False if no one is active."""
+        # The meeting-prep call may long-poll, so reminders don't wait on it
+        has_users, reminders = await asyncio.gather(
+            self._check_triggers(),
+            self._check_cron_reminders(),
+            return_exceptions=True,
+        )
+        if isinstance(reminders, BaseException):
+            logger.error("Cron reminder check failed", exc_info=reminders)
+        if isinstance(has_users, BaseException):
+            logger.error("Trigger check failed", exc_info=has_users)
+            return False
+        return has_users
+
+    async def _check_triggers(self) -> bool:
+        """Check meeting prep for every active user.  Returns False if there are none."""
         # Fetch all active users from imessage_users
         active_users = await self._get_active_users()
 
         if not active_users:
-            return
+            return False
 
+        targets: list[tuple[str, str, BoundedSet]] = []
         for user in active_users:
             user_id = user.get("user_id")
             phone = user.get("phone_number")
             if not user_id or not phone:
                 continue
 
-            fired = self._fired_event_ids.setdefault(user_id, set())
-            await self._check_user_triggers(user_id, phone, fired)
+            fired = self._fired_event_ids.get(user_id)
+            if fired is None:
+                fired = self._fired_event_ids[user_id] = BoundedSet(MAX_FIRED_EVENT_IDS)
+            targets.append((user_id, phone, fired))
+
+        if targets and BULK_MEETING_PREP:
+            targets = await self._check_triggers_bulk(targets)
+
+        # Users are independent, so their checks overlap instead of adding up
+        await asyncio.gather(*(self._check_user_triggers(*t) for t in targets))
+        return True
+
+    def _active_users_fresh(self) -> bool:
+        return (
+            self._active_users is not None
+            and time.monotonic() - self._active_users_at < ACTIVE_USERS_TTL_SECONDS
+        )
 
     async def _get_active_users(self) -> list[dict]:
-        """Fetch all active users from imessage_users."""
+        """Fetch all active users from imessage_users (cached briefly).
+
+        Concurrent callers share a single request.
+        """
+        if self._active_users_fresh():
+            return self._active_users
+        if self._active_users_fetch is None:
+            fetch = asyncio.create_task(self._fetch_active_users())
+            fetch.add_done_callback(self._clear_active_users_fetch)
+            self._active_users_fetch = fetch
+        return await asyncio.shield(self._active_users_fetch)
+
+    def _clear_active_users_fetch(self, _: asyncio.Task) -> None:
+        self._active_users_fetch = None
+
+    async def _fetch_active_users(self) -> list[dict]:
         try:
             resp = await self._http.get(
-                f"{self.config.supabase_url}/rest/v1/imessage_users",
+                self._users_url,
                 params={
                     "status": "eq.active",
                     "select": "user_id,phone_number",
                 },
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "apikey": self.config.supabase_service_role_key,
-                },
             )
             if resp.status_code == 200:
-                return resp.json()
+                users = _json_loads(resp.content)
+                self._active_users = users
+                self._active_phones = {
+                    u["user_id"]: u["phone_number"]
+                    for u in users
+                    if u.get("user_id") and u.get("phone_number")
+                }
+                self._active_users_at = time.monotonic()
+                return users
         except Exception:
             logger.exception("Failed to fetch active users")
         return []
 
+    async def _check_triggers_bulk(
+        self, targets: list[tuple[str, str, BoundedSet]]
+    ) -> list[tuple[str, str, BoundedSet]]:
+        """Check every user in one v2-trigger call and deliver the results.
+
+        Returns the users still to be checked one by one.  The request also
+        names the first user on its own, so a deployment without bulk
+        support answers for that user and the rest fall back.
+        """
+        first_id, _, first_fired = targets[0]
+
+        try:
+            resp = await self._http.post(
+                self._trigger_url,
+                content=_json_dumps({
+                    "action": "meeting_prep",
+                    "user_id": first_id,
+                    "fired_event_ids": list(first_fired),
+                    "users": [
+                        {"user_id": user_id, "fired_event_ids": list(fired)}
+                        for user_id, _, fired in targets
+                    ],
+                    "wait_seconds": LONG_POLL_SECONDS,
+                }),
+                headers=_JSON_HEADERS,
+                timeout=BULK_REQUEST_TIMEOUT + LONG_POLL_SECONDS,
+            )
+            if resp.status_code != 200:
+                logger.warning(
+                    "Bulk v2-trigger returned %d, checking users individually: %s",
+                    resp.status_code, resp.text[:200],
+                )
+                return targets
+            data = _json_loads(resp.content)
+        except httpx.TimeoutException:
+            # Preps may already have been generated; retrying per user now
+            # would duplicate them, so wait for the next tick
+            logger.warning("Bulk v2-trigger request timed out")
+            return []
+        except Exception:
+            logger.exception("Bulk trigger check failed")
+            return []
+
+        results = data.get("results")
+        if isinstance(results, dict):
+            covered, remaining = targets, []
+        else:
+            logger.warning("v2-trigger has no bulk meeting prep, checking users individually")
+            results = {first_id: data}
+            covered, remaining = targets[:1], targets[1:]
+
+        await asyncio.gather(*(
+            self._deliver_meeting_prep(user_id, phone, fired, results.get(user_id) or {})
+            for user_id, phone, fired in covered
+        ))
+        return remaining
+
     async def _check_user_triggers(
-        self, user_id: str, phone: str, fired: set[str]
+        self, user_id: str, phone: str, fired: BoundedSet
     ) -> None:
-        url = f"{self.config.supabase_url}/functions/v1/v2-trigger"
+        async with self._trigger_sem:
+            await self._check_user_triggers_unlocked(user_id, phone, fired)
 
+    async def _check_user_triggers_unlocked(
+        self, user_id: str, phone: str, fired: BoundedSet
+    ) -> None:
         try:
             resp = await self._http.post(
-                url,
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
+                self._trigger_url,
+                content=_json_dumps({
                     "action": "meeting_prep",
                     "user_id": user_id,
                     "fired_event_ids": list(fired),
-                },
+                }),
+                headers=_JSON_HEADERS,
             )
 
             if resp.status_code != 200:
@@ -122,55 +361,79 @@ class TriggerChecker:
                 )
                 return
 
-            data = resp.json()
-            messages: list[str] = data.get("messages", [])
-            event_ids: list[str] = data.get("event_ids", [])
+            await self._deliver_meeting_prep(user_id, phone, fired, _json_loads(resp.content))
 
-            if not messages:
-                return
+        except httpx.TimeoutException:
+            logger.warning("v2-trigger request timed out for user %s", user_id[:8])
+        except Exception:
+            logger.exception("Trigger check failed for user %s", user_id[:8])
 
-            logger.info(
-                "Trigger checker: %d meeting prep message(s) for user %s",
-                len(messages), user_id[:8],
-            )
+    async def _deliver_meeting_prep(
+        self, user_id: str, phone: str, fired: BoundedSet, data: dict
+    ) -> None:
+        """Record a v2-trigger meeting-prep result and send its messages."""
+        messages: list[str] = data.get("messages", [])
+        event_ids: list[str] = data.get("event_ids", [])
 
-            for eid in event_ids:
-                fired.add(eid)
+        if not messages:
+            return
 
-            # Prune old event IDs
-            if len(fired) > 100:
-                overflow = len(fired) - 50
-                for _ in range(overflow):
-                    fired.pop()
+        logger.info(
+            "Trigger checker: %d meeting prep message(s) for user %s",
+            len(messages), user_id[:8],
+        )
+
+        if event_ids:
+            fired.update(event_ids)
+            self.state.mark_dirty()
+        for msg in messages:
+            if msg.strip():
+                self._enqueue_send(phone, "Meeting prep", msg)
+
+    # ── Per-phone send queues ──────────────────────────────
+
+    def _enqueue_send(self, phone: str, kind: str, text: str) -> None:
+        """Queue *text* for *phone* without waiting for it to be sent.
+
+        Each phone's messages go out in order, SEND_SPACING_SECONDS apart,
+        from that phone's own drain task, so the spacing never holds up a
+        tick or another phone's sends.
+        """
+        queue = self._send_queues.get(phone)
+        if queue is None:
+            queue = self._send_queues[phone] = asyncio.Queue()
+            self._send_tasks[phone] = asyncio.create_task(
+                self._drain_sends(phone, queue), name=f"trigger_send:{phone}"
+            )
+        queue.put_nowait((kind, text))
 
-            for msg in messages:
-                if msg.strip():
-                    sent = await send_imessage(phone, msg)
+    async def _drain_sends(self, phone: str, queue: asyncio.Queue[tuple[str, str]]) -> None:
+        try:
+            while not queue.empty():
+                kind, text = queue.get_nowait()
+                try:
+                    sent = await send_imessage(phone, text)
                     if sent:
-                        logger.info("Meeting prep sent to %s", phone)
+                        logger.info("%s sent to %s: %s", kind, phone, text[:60])
                     else:
-                        logger.error("Failed to send meeting prep to %s", phone)
-                    await asyncio.sleep(2.0)
-
-        except httpx.TimeoutException:
-            logger.warning("v2-trigger request timed out for user %s", user_id[:8])
-        except Exception:
-            logger.exception("Trigger check failed for user %s", user_id[:8])
+                        logger.error("Failed to send %s to %s", kind.lower(), phone)
+                except Exception:
+                    logger.exception("Failed to send %s to %s", kind.lower(), phone)
+                # Hold the gap even if the next message arrives meanwhile
+                await asyncio.sleep(SEND_SPACING_SECONDS)
+        finally:
+            del self._send_queues[phone]
+            del self._send_tasks[phone]
 
     # ── Cron reminder delivery ─────────────────────────────
 
     async def _check_cron_reminders(self) -> None:
         """Poll v2-trigger for due cron reminders and deliver via iMessage."""
-        url = f"{self.config.supabase_url}/functions/v1/v2-trigger"
-
         try:
             resp = await self._http.post(
-                url,
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "Content-Type": "application/json",
-                },
-                json={"action": "check_cron_reminders"},
+                self._trigger_url,
+                content=_CRON_REMINDERS_BODY,
+                headers=_JSON_HEADERS,
             )
 
             if resp.status_code != 200:
@@ -180,7 +443,7 @@ class TriggerChecker:
                 )
                 return
 
-            data = resp.json()
+            data = _json_loads(resp.content)
             messages = data.get("messages", [])
 
             if not messages:
@@ -200,12 +463,7 @@ class TriggerChecker:
                     logger.warning("No phone for user %s, skipping reminder", user_id[:8])
                     continue
 
-                sent = await send_imessage(phone, message)
-                if sent:
-                    logger.info("Reminder sent to %s: %s", phone, message[:60])
-                else:
-                    logger.error("Failed to send reminder to %s", phone)
-                await asyncio.sleep(2.0)
+                self._enqueue_send(phone, "Reminder", message)
 
         except httpx.TimeoutException:
             logger.warning("v2-trigger cron reminder request timed out")
@@ -214,22 +472,26 @@ class TriggerChecker:
 
     async def _get_user_phone(self, user_id: str) -> str | None:
         """Look up a user's phone number from imessage_users."""
+        # The cached active list answers most lookups; a miss may be a user
+        # who became active since, so it still goes to the table.  A refresh
+        # already under way (a tick runs reminders alongside meeting prep)
+        # is waited for rather than raced with per-user queries.
+        if self._active_users_fetch is not None:
+            await asyncio.shield(self._active_users_fetch)
+        if self._active_users_fresh() and user_id in self._active_phones:
+            return self._active_phones[user_id]
         try:
             resp = await self._http.get(
-                f"{self.config.supabase_url}/rest/v1/imessage_users",
+                self._users_url,
                 params={
                     "user_id": f"eq.{user_id}",
                     "status": "eq.active",
                     "select": "phone_number",
                     "limit": "1",
                 },
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "apikey": self.config.supabase_service_role_key,
-                },
             )
             if resp.status_code == 200:
-                rows = resp.json()
+                rows = _json_loads(resp.content)
                 if rows:
                     return rows[0].get("phone_number")
         except Exception:
@@ -238,32 +500,34 @@ class TriggerChecker:
 
     # ── Onboarding drip sequence ────────────────────────────
 
-    async def _check_onboard_drips(self) -> None:
-        """Send follow-up messages to pending users who haven't signed up."""
+    async def _check_onboard_drips(self) -> bool:
+        """Send follow-up messages to pending users who haven't signed up.
+
+        Returns False if no pending user is due.
+        """
         pending = await self._get_pending_users()
         if not pending:
-            return
+            return False
 
         now = datetime.now(timezone.utc)
+        # (phone, step) for every drip sent this tick, recorded in one call
+        sent_steps: list[tuple[str, int]] = []
 
         for user in pending:
             phone = user.get("phone_number")
             step = user.get("drip_step") or 0
             token = user.get("onboarding_token") or ""
-            count = user.get("onboard_count") or 0
 
+            # Users without a conversation exchange yet were filtered out by
+            # _get_pending_users
             if not phone or not token:
                 continue
 
-            # Only start drips after the user has had at least one conversation exchange
-            if count < 1:
-                continue
-
             # Already exhausted all drip steps
-            if step >= len(_DRIP_SEQUENCE):
+            if step >= len(_DRIP_STEPS):
                 continue
 
-            next_step, delay_minutes, template = _DRIP_SEQUENCE[step]
+            next_step, delay_seconds, template_parts = _DRIP_STEPS[step]
 
             # Reference time: last_drip_at if drips have started, otherwise updated_at
             ref_raw = user.get("last_drip_at") or user.get("updated_at")
@@ -271,69 +535,104 @@ class TriggerChecker:
                 continue
 
             if isinstance(ref_raw, str):
-                ref_time = datetime.fromisoformat(ref_raw.replace("Z", "+00:00"))
+                ref_time = _parse_timestamp(ref_raw)
             else:
                 ref_time = ref_raw
 
-            elapsed_minutes = (now - ref_time).total_seconds() / 60.0
-            if elapsed_minutes < delay_minutes:
+            elapsed_seconds = (now - ref_time).total_seconds()
+            if elapsed_seconds < delay_seconds:
                 continue
 
             onboard_url = f"https://nest.expert/?token={token}"
-            message = template.replace("{{URL}}", onboard_url)
+            message = onboard_url.join(template_parts)
 
             logger.info(
                 "Sending drip step %d to %s (%.0f min since last touch)",
-                next_step, phone, elapsed_minutes,
+                next_step, phone, elapsed_seconds / 60.0,
             )
 
             sent = await send_imessage(phone, message)
             if sent:
-                await self._update_drip_step(phone, next_step)
+                sent_steps.append((phone, next_step))
                 logger.info("Drip step %d sent to %s", next_step, phone)
             else:
                 logger.error("Failed to send drip step %d to %s", next_step, phone)
 
+        if sent_steps:
+            await self._update_drip_steps(sent_steps)
+        return True
+
     async def _get_pending_users(self) -> list[dict]:
-        """Fetch pending/onboarding users who might need a drip message."""
+        """Fetch pending/onboarding users who might need a drip message.
+
+        Users who haven't had a conversation exchange yet, or whose last
+        touch is more recent than the shortest drip delay, are filtered out
+        by PostgREST; _check_onboard_drips still applies the per-step delay.
+        """
+        cutoff = (datetime.now(timezone.utc) - _MIN_DRIP_DELAY).isoformat()
         try:
             resp = await self._http.get(
-                f"{self.config.supabase_url}/rest/v1/imessage_users",
+                self._users_url,
                 params={
                     "status": "in.(pending,onboarding)",
                     "drip_step": "lt.1",
-                    "select": "phone_number,onboarding_token,onboard_count,drip_step,last_drip_at,updated_at",
-                },
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "apikey": self.config.supabase_service_role_key,
+                    "onboard_count": "gte.1",
+                    # Reference time is last_drip_at, else updated_at
+                    "or": (
+                        f"(last_drip_at.lte.{cutoff},"
+                        f"and(last_drip_at.is.null,updated_at.lte.{cutoff}))"
+                    ),
+                    # onboard_count is only filtered on, so it isn't fetched
+                    "select": "phone_number,onboarding_token,drip_step,last_drip_at,updated_at",
                 },
             )
             if resp.status_code == 200:
-                return resp.json()
+                return _json_loads(resp.content)
         except Exception:
             logger.exception("Failed to fetch pending users for drip")
         return []
 
+    async def _update_drip_steps(self, sent_steps: list[tuple[str, int]]) -> None:
+        """Mark the drip steps as sent in the DB, in one call if possible."""
+        try:
+            resp = await self._http.post(
+                self._drip_rpc_url,
+                content=_json_dumps({
+                    "updates": [
+                        {"phone": phone, "step": step} for phone, step in sent_steps
+                    ],
+                }),
+                headers=_JSON_HEADERS,
+            )
+            if resp.is_success:
+                return
+            logger.warning(
+                "bulk_update_drip_steps returned %d, updating users individually: %s",
+                resp.status_code, resp.text[:200],
+            )
+        except Exception:
+            logger.exception("Bulk drip step update failed, updating users individually")
+
+        for phone, step in sent_steps:
+            await self._update_drip_step(phone, step)
+
     async def _update_drip_step(self, phone: str, step: int) -> None:
         """Mark the drip step as sent in the DB."""
         try:
             await self._http.patch(
-                f"{self.config.supabase_url}/rest/v1/imessage_users",
+                self._users_url,
                 params={"phone_number": f"eq.{phone}"},
-                headers={
-                    "Authorization": f"Bearer {self.config.supabase_service_role_key}",
-                    "apikey": self.config.supabase_service_role_key,
-                    "Content-Type": "application/json",
-                },
-                json={
+                content=_json_dumps({
                     "drip_step": step,
                     "last_drip_at": datetime.now(timezone.utc).isoformat(),
-                },
+                }),
+                headers=_JSON_HEADERS,
             )
         except Exception:
             logger.exception("Failed to update drip step for %s", phone)
 
     async def close(self) -> None:
         self._running = False
+        for task in list(self._send_tasks.values()):
+            task.cancel()
         await self._http.aclose()
@@ -3,6 +3,11 @@
 // Two modes:
 //   1. POST { action: "meeting_prep", user_id } — called by iMessage bridge every 60s
 //      Returns upcoming meetings (8-12 min window) with RAG-enriched prep.
+//      With a `users: [{ user_id, fired_event_ids }]` list it checks them all
+//      in one call and returns { results: { [user_id]: { messages, event_ids } } }.
+//      With `wait_seconds` it long-polls: when nothing is due yet but a known
+//      meeting enters the window within that time, the call is held open and
+//      answers as soon as it does.
 //   2. POST (no action) — legacy cron mode for email triggers
 //
 // Meeting prep pipeline:
@@ -42,12 +47,23 @@ Deno.serve(async (req: Request) => {
     body = await req.json().catch(() => ({}));
   } catch { /* ignore */ }
 
+  // Bulk meeting prep: one call for every active user.  Checked first so
+  // older deployments, which ignore `users`, still answer for `user_id`.
+  if (body?.action === "meeting_prep" && Array.isArray(body?.users)) {
+    return await handleMeetingPrepBulk(
+      body.users,
+      body.test_window_hours ?? 0,
+      body.wait_seconds ?? 0
+    );
+  }
+
   // Route to meeting prep mode if requested
   if (body?.action === "meeting_prep" && body?.user_id) {
     return await handleMeetingPrep(
       body.user_id,
       body.fired_event_ids ?? [],
-      body.test_window_hours ?? 0
+      body.test_window_hours ?? 0,
+      body.wait_seconds ?? 0
     );
   }
 
@@ -67,11 +83,103 @@ Deno.serve(async (req: Request) => {
 
 // ── Meeting Prep Handler ─────────────────────────────────────
 
+type MeetingPrepResult = {
+  messages: string[];
+  event_ids?: string[];
+  error?: string;
+  // When the next known meeting enters the prep window (epoch ms)
+  next_due_ms?: number;
+};
+
+// Users prepared at once by the bulk handler (each may make several LLM calls)
+const BULK_PREP_CONCURRENCY = 8;
+
+// Meetings are prepped when they start 8-12 minutes from now
+const PREP_WINDOW_START_MS = 8 * 60 * 1000;
+const PREP_WINDOW_END_MS = 12 * 60 * 1000;
+
+// Longest a long-polling meeting_prep call is held open
+const MAX_WAIT_SECONDS = 55;
+
 async function handleMeetingPrep(
   userId: string,
   alreadyFiredIds: string[],
-  testWindowHours = 0
+  testWindowHours = 0,
+  waitSeconds = 0
+): Promise<Response> {
+  const deadlineMs = waitDeadline(waitSeconds);
+  while (true) {
+    const result = await meetingPrepForUser(userId, alreadyFiredIds, testWindowHours);
+    const delayMs = nextCheckDelay([result], deadlineMs);
+    if (delayMs === null) return jsonResponse(result, 200);
+    await sleep(delayMs);
+  }
+}
+
+async function handleMeetingPrepBulk(
+  users: Array<{ user_id?: string; fired_event_ids?: string[] }>,
+  testWindowHours = 0,
+  waitSeconds = 0
 ): Promise<Response> {
+  const pending = users.filter((u) => typeof u?.user_id === "string" && u.user_id);
+  const deadlineMs = waitDeadline(waitSeconds);
+
+  while (true) {
+    const results: Record<string, MeetingPrepResult> = {};
+
+    let next = 0;
+    const worker = async () => {
+      while (next < pending.length) {
+        const user = pending[next++];
+        results[user.user_id!] = await meetingPrepForUser(
+          user.user_id!,
+          user.fired_event_ids ?? [],
+          testWindowHours
+        );
+      }
+    };
+    await Promise.all(
+      Array.from({ length: Math.min(BULK_PREP_CONCURRENCY, pending.length) }, worker)
+    );
+
+    const delayMs = nextCheckDelay(Object.values(results), deadlineMs);
+    if (delayMs === null) return jsonResponse({ results }, 200);
+    await sleep(delayMs);
+  }
+}
+
+function waitDeadline(waitSeconds: unknown): number {
+  const seconds = typeof waitSeconds === "number" && waitSeconds > 0
+    ? Math.min(waitSeconds, MAX_WAIT_SECONDS)
+    : 0;
+  return Date.now() + seconds * 1000;
+}
+
+// How long to sleep before checking again, or null to answer now: when
+// something was found, or no known meeting comes due before the deadline.
+function nextCheckDelay(
+  results: MeetingPrepResult[],
+  deadlineMs: number
+): number | null {
+  let nextDueMs = Infinity;
+  for (const r of results) {
+    if (r.messages.length > 0 || (r.event_ids?.length ?? 0) > 0 || r.error) {
+      return null;
+    }
+    if (r.next_due_ms !== undefined && r.next_due_ms < nextDueMs) {
+      nextDueMs = r.next_due_ms;
+    }
+  }
+  if (nextDueMs >= deadlineMs) return null;
+  // A second past the boundary so the window (end-exclusive) includes it
+  return Math.max(0, nextDueMs - Date.now()) + 1000;
+}
+
+async function meetingPrepForUser(
+  userId: string,
+  alreadyFiredIds: string[],
+  testWindowHours = 0
+): Promise<MeetingPrepResult> {
   const start = Date.now();
 
   try {
@@ -80,10 +188,10 @@ async function handleMeetingPrep(
     // Normal: 8-12 minute window. Test mode: wider window for testing.
     const windowStartMs = testWindowHours > 0
       ? nowMs
-      : nowMs + 8 * 60 * 1000;
+      : nowMs + PREP_WINDOW_START_MS;
     const windowEndMs = testWindowHours > 0
       ? nowMs + testWindowHours * 60 * 60 * 1000
-      : nowMs + 12 * 60 * 1000;
+      : nowMs + PREP_WINDOW_END_MS;
 
     console.log(
       `[v2-trigger] Meeting prep check: window ${new Date(windowStartMs).toISOString()} → ${new Date(windowEndMs).toISOString()}`
@@ -102,16 +210,17 @@ async function handleMeetingPrep(
 
     if (error) {
       console.error("[v2-trigger] Calendar query error:", error.message);
-      return jsonResponse({ messages: [], error: error.message }, 200);
+      return { messages: [], error: error.message };
     }
 
     if (!candidateEvents || candidateEvents.length === 0) {
-      return jsonResponse({ messages: [], event_ids: [] }, 200);
+      return { messages: [], event_ids: [] };
     }
 
     // Parse dates properly and filter to the exact window
     const firedSet = new Set(alreadyFiredIds);
     const seen = new Set<string>();
+    let nextStartMs = Infinity;
     const events = candidateEvents.filter((e: any) => {
       const eventId = e.metadata?.event_id || e.id;
       if (firedSet.has(eventId) || seen.has(eventId)) return false;
@@ -121,6 +230,7 @@ async function handleMeetingPrep(
 
       const startMs = new Date(startStr).getTime();
       if (isNaN(startMs)) return false;
+      if (startMs >= windowEndMs && startMs < nextStartMs) nextStartMs = startMs;
       if (startMs < windowStartMs || startMs >= windowEndMs) return false;
 
       seen.add(eventId);
@@ -128,7 +238,9 @@ async function handleMeetingPrep(
     });
 
     if (events.length === 0) {
-      return jsonResponse({ messages: [], event_ids: [] }, 200);
+      return testWindowHours > 0 || nextStartMs === Infinity
+        ? { messages: [], event_ids: [] }
+        : { messages: [], event_ids: [], next_due_ms: nextStartMs - PREP_WINDOW_END_MS };
     }
 
     console.log(`[v2-trigger] Found ${events.length} upcoming event(s) for prep`);
@@ -166,11 +278,11 @@ async function handleMeetingPrep(
       `[v2-trigger] Meeting prep: ${messages.length} message(s) generated (${elapsed}ms)`
     );
 
-    return jsonResponse({ messages, event_ids: eventIds }, 200);
+    return { messages, event_ids: eventIds };
   } catch (err) {
     const msg = err instanceof Error ? err.message : "unknown";
     console.error("[v2-trigger] Meeting prep error:", msg);
-    return jsonResponse({ messages: [], event_ids: [], error: msg }, 200);
+    return { messages: [], event_ids: [], error: msg };
   }
 }
 
@@ -615,6 +727,10 @@ function localTimeToUtc(hour: number, minute: number, tz: string): Date {
 
 // ── Helpers ──────────────────────────────────────────────────
 
+function sleep(ms: number): Promise<void> {
+  return new Promise((r) => setTimeout(r, ms));
+}
+
 function jsonResponse(
   body: Record<string, unknown>,
   status: number
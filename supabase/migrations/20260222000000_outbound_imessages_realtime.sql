@@ -0,0 +1,3 @@
+-- Publish outbound_imessages over Realtime so the iMessage bridge is pushed
+-- new rows instead of polling the table every second.
+alter publication supabase_realtime add table outbound_imessages;
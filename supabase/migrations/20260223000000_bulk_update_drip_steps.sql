@@ -0,0 +1,22 @@
+-- Record a whole drip tick's sends in one call instead of one PATCH per user.
+-- The iMessage bridge posts {"updates": [{"phone": ..., "step": ...}, ...]}.
+
+ALTER TABLE public.imessage_users
+  ADD COLUMN IF NOT EXISTS drip_step INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS last_drip_at TIMESTAMPTZ;
+
+CREATE OR REPLACE FUNCTION bulk_update_drip_steps(updates JSONB)
+RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    UPDATE imessage_users u
+    SET drip_step = x.step,
+        last_drip_at = now()
+    FROM jsonb_to_recordset(updates) AS x(phone TEXT, step INTEGER)
+    WHERE u.phone_number = x.phone;
+$$;
+
+REVOKE EXECUTE ON FUNCTION bulk_update_drip_steps(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION bulk_update_drip_steps(JSONB) TO service_role;